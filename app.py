@@ -1,5 +1,6 @@
 # app.py (V43.0 暴力清扫 & 补漏版)
 import os
+import io
 import sys
 import time
 import json
@@ -8,11 +9,26 @@ import smtplib
 import logging
 import queue
 import shutil
+import sqlite3
+import hashlib
+import struct
+import ctypes
+import ctypes.util
+import re
+import fnmatch
+import random
+import zlib
+import tarfile
+import bisect
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.header import Header
-from email.utils import formataddr
+from email.utils import formataddr, parsedate_to_datetime
 from flask import Flask, render_template, request, jsonify, Response
-from huggingface_hub import HfApi
+from huggingface_hub import HfApi, CommitOperationAdd, CommitOperationCopy
+from huggingface_hub.lfs import UploadInfo, post_lfs_batch_info, LFS_HEADERS
+from huggingface_hub.utils import http_backoff, hf_raise_for_status, build_hf_headers
 
 # 强制 UTF-8
 sys.stdout.reconfigure(encoding='utf-8')
@@ -23,34 +39,64 @@ app = Flask(__name__)
 # ================= 全局配置 =================
 CONFIG_FILE = "/app/config/settings.json"
 DATA_DIR = "/app/data"
-LOG_QUEUE = queue.Queue(maxsize=500)
 FAILURE_RECORD_FILE = "/app/config/failures.json"
+STATE_DB_FILE = "/app/config/state.db"
 
 DEFAULT_CONFIG = {
     "hf_endpoint": "https://hf-mirror.com", 
     "hf_token": "", "repo_id": "", "repo_type": "dataset", "remote_folder": "",
     "email_host": "", "email_port": "", "email_user": "", "email_pass": "", "email_to": "",
     "warn_timeout": 900, "kill_timeout": 1800, "idle_interval": 1800,
-    "max_retries": 5, "notify_min_size": 1024, "file_interval": 15, 
+    "max_retries": 5, "notify_min_size": 1024,
+    "max_commits_per_min": 10, # 每分钟最多提交次数，Hub 返回 429 时自动降速
     "delete_after_upload": True,
     "enable_hf_transfer": False,
     "enable_idle_email": False,
-    "stability_duration": 30 # 默认改为30秒，加快响应
+    "stability_duration": 30, # 默认改为30秒，加快响应
+    "enable_batch_commit": False, # 批量提交：多个文件合并为一次 commit
+    "batch_max_files": 50, "batch_max_mb": 1024,
+    "upload_workers": 1, "max_upload_mbps": 0, # 上传线程数 / 全局限速(MB/s, 0为不限)
+    "watch_mode": "auto", # auto: 优先 inotify 实时监听；poll: 每轮全量扫描
+    "remote_cache_ttl": 600, # 云端文件信息缓存时间(秒)
+    "enable_dedup": True, # 按内容哈希去重，云端校验比对哈希而不只是大小
+    "resumable_min_mb": 1024, # 超过该大小的文件走分片断点续传 (MB, 0为关闭)
+    "email_digest_window": 60, # 该时间内的多条通知合并成一封邮件 (秒, 0为逐条发送)
+    "include_patterns": "", # 只上传匹配的文件 (glob，逗号分隔，留空为全部)
+    "exclude_patterns": "*.json", # 不上传匹配的文件 (glob，逗号分隔)
+    "pack_mode": "off", # 小文件打包：off / tar / zip，文件多的文件夹流式打成分片上传
+    "pack_min_files": 1000, "pack_shard_mb": 512, # 文件夹至少多少个文件才打包 / 每个分片的目标大小(MB)
+    "targets": [] # 多目标路由：[{"name", "paths", "repo_id", ...}]，按路径规则上传到不同仓库
 }
 
 uploader_thread = None
 stop_event = threading.Event()
 is_running = False
 
-# 日志配置
+# 日志配置：环形缓冲 + 序号，每个网页连接都能收到全部日志，断线重连按 Last-Event-ID 补发
+class LogBroadcaster:
+    def __init__(self, size=500):
+        self.cond = threading.Condition()
+        self.buffer = deque(maxlen=size) # (序号, 日志)
+        self.seq = 0
+
+    def publish(self, msg):
+        with self.cond:
+            self.seq += 1
+            self.buffer.append((self.seq, msg))
+            self.cond.notify_all()
+
+    def read_after(self, last_seq, timeout):
+        """返回序号大于 last_seq 的日志；暂时没有就在条件变量上等待，最多 timeout 秒"""
+        with self.cond:
+            if self.seq < last_seq: last_seq = 0 # 服务重启过，序号从头开始：先补发缓冲区，不要空等一个超时
+            if self.seq <= last_seq: self.cond.wait(timeout)
+            return [item for item in self.buffer if item[0] > last_seq]
+
+LOG_BROADCASTER = LogBroadcaster()
+
 class QueueHandler(logging.Handler):
     def emit(self, record):
-        try:
-            msg = self.format(record)
-            if LOG_QUEUE.full():
-                try: LOG_QUEUE.get_nowait()
-                except: pass
-            LOG_QUEUE.put(msg)
+        try: LOG_BROADCASTER.publish(self.format(record))
         except: pass
 
 logger = logging.getLogger("HF_Uploader")
@@ -65,7 +111,155 @@ console_handler = logging.StreamHandler()
 console_handler.setFormatter(console_formatter)
 logger.addHandler(console_handler)
 
+# 🌟 运行指标：Prometheus 文本格式，由 /metrics 输出
+class Metrics:
+    """极简的计数器 / 仪表 / 直方图，线程安全，不依赖 prometheus_client"""
+    BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meta = {}    # 指标名 -> (类型, 说明)
+        self.values = {}  # (指标名, 标签) -> 数值；直方图为 [各桶计数, 总和, 次数]
+
+    def describe(self, name, kind, help_text):
+        self.meta[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock: self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock: self.values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.values.setdefault(key, [[0] * len(self.BUCKETS), 0.0, 0])
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound: hist[0][i] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def timer(self, name, **labels):
+        metrics = self
+        class _Timer:
+            def __enter__(self):
+                self.start = time.perf_counter()
+                return self
+            def __exit__(self, *exc):
+                self.elapsed = time.perf_counter() - self.start
+                metrics.observe(name, self.elapsed, **labels)
+        return _Timer()
+
+    def render(self):
+        def fmt_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs: return ""
+            return "{" + ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self.lock: items = sorted((k, v if not isinstance(v, list) else [list(v[0]), v[1], v[2]]) for k, v in self.values.items())
+        for name, (kind, help_text) in sorted(self.meta.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in items:
+                if metric != name: continue
+                if kind != "histogram":
+                    lines.append(f"{name}{fmt_labels(labels)} {value}")
+                    continue
+                for bound, count in zip(self.BUCKETS, value[0]):
+                    lines.append(f"{name}_bucket{fmt_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{fmt_labels(labels, [('le', '+Inf')])} {value[2]}")
+                lines.append(f"{name}_sum{fmt_labels(labels)} {value[1]}")
+                lines.append(f"{name}_count{fmt_labels(labels)} {value[2]}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+METRICS.describe("hf_uploader_running", "gauge", "1 when the uploader daemon is running")
+METRICS.describe("hf_uploader_scan_duration_seconds", "histogram", "Time spent collecting candidate files per scan cycle")
+METRICS.describe("hf_uploader_files_scanned_total", "counter", "Candidate files returned by the scanner")
+METRICS.describe("hf_uploader_stability_check_seconds", "histogram", "Time spent snapshotting a pending folder")
+METRICS.describe("hf_uploader_stability_wait_seconds", "histogram", "Time from first seeing a folder until it is stable")
+METRICS.describe("hf_uploader_pending_files", "gauge", "Files queued or uploading")
+METRICS.describe("hf_uploader_pending_jobs", "gauge", "Upload jobs waiting in the priority queue")
+METRICS.describe("hf_uploader_upload_duration_seconds", "histogram", "Wall time per upload (single file, resumable file or batch commit), including retries")
+METRICS.describe("hf_uploader_uploaded_bytes_total", "counter", "Bytes of files confirmed uploaded")
+METRICS.describe("hf_uploader_files_total", "counter", "Files finished, by result")
+METRICS.describe("hf_uploader_retries_total", "counter", "Upload attempts that failed and were retried, by error class")
+METRICS.describe("hf_uploader_commit_rate_per_min", "gauge", "Current adaptive commit rate limit")
+METRICS.describe("hf_uploader_remote_checks_total", "counter", "Remote existence/size checks")
+METRICS.describe("hf_uploader_remote_requests_total", "counter", "HTTP requests made by the remote index")
+METRICS.describe("hf_uploader_remote_request_seconds", "histogram", "Latency of remote index HTTP requests")
+
+# 🌟 状态面板：待传队列、正在上传的任务、上传历史，/api/* 接口只读内存，不访问磁盘
+class StatusBoard:
+    """守护线程每轮扫描写入待传文件夹，上传线程登记正在传的任务；历史记录直接读 StateStore 的内存镜像"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local() # 当前上传线程正在处理的任务号，供 TransferProgress 找到自己的任务
+        self.waiting = []   # 还没进上传队列的文件夹
+        self.pools = {}     # 目标名 -> UploadPool
+        self.transfers = {} # 任务号 -> 正在上传的任务
+        self.seq = 0
+        self.store = None
+
+    def attach(self, store, pools=None):
+        """守护线程启动时换上自己的状态库；停止后接口按需重新打开一个只读用的"""
+        with self.lock:
+            old, self.store = self.store, store
+            self.pools = pools if pools is not None else {}
+            self.waiting = []
+            self.transfers = {}
+        if old is not None and old is not store: old.close()
+
+    def history_store(self):
+        with self.lock:
+            if self.store is None and os.path.exists(STATE_DB_FILE): self.store = StateStore(STATE_DB_FILE)
+            return self.store
+
+    def set_waiting(self, folders):
+        with self.lock: self.waiting = folders
+
+    def start_transfer(self, **info):
+        with self.lock:
+            self.seq += 1
+            self.transfers[self.seq] = dict(info, id=self.seq, started=time.time(), sent=None)
+            self.local.tid = self.seq
+            return self.seq
+
+    def current(self):
+        return getattr(self.local, 'tid', None)
+
+    def progress(self, tid, sent, resumed_from=None):
+        with self.lock:
+            if tid not in self.transfers: return
+            self.transfers[tid]['sent'] = sent
+            if resumed_from is not None: self.transfers[tid].update(resumed_from=resumed_from, progress_started=time.time())
+
+    def end_transfer(self, tid):
+        with self.lock: self.transfers.pop(tid, None)
+        self.local.tid = None
+
+    def queue(self):
+        with self.lock: waiting, pools = list(self.waiting), list(self.pools.values())
+        folders = waiting + [item for pool in pools for item in pool.queue_status()]
+        return {"running": is_running, "folders": folders,
+                "files": sum(f['files'] for f in folders), "bytes": sum(f['bytes'] for f in folders)}
+
+    def active(self):
+        now = time.time()
+        with self.lock: transfers = [dict(t) for t in self.transfers.values()]
+        for t in transfers:
+            t['elapsed'] = round(now - t['started'], 1)
+            if t['sent'] is not None: # 只有分片续传的大文件能拿到实时进度
+                t['percent'] = round(t['sent'] * 100 / max(t['bytes'], 1), 1)
+                t['speed'] = round((t['sent'] - t['resumed_from']) / max(now - t['progress_started'], 0.001))
+        return {"running": is_running, "transfers": sorted(transfers, key=lambda t: t['id'])}
+
+STATUS = StatusBoard()
+
 JUNK_FILES = {'.DS_Store', 'Thumbs.db', 'desktop.ini', '@eaDir', '.smbdelete'}
+TEMP_SUFFIXES = ('.xltd', '.tmp', '.download')
 
 def load_config():
     if not os.path.exists(CONFIG_FILE): return DEFAULT_CONFIG.copy()
@@ -88,17 +282,306 @@ def save_config(config):
         return True
     except: return False
 
-def load_failures():
-    if not os.path.exists(FAILURE_RECORD_FILE): return {}
-    try:
-        with open(FAILURE_RECORD_FILE, 'r', encoding='utf-8') as f: return json.load(f)
-    except: return {}
+# 🌟 上传状态库：SQLite (WAL)，每个文件一行，单条更新，崩溃后自动恢复
+class StateStore:
+    """记录每个文件的上传状态。内存里保留一份镜像，扫描时查状态不用访问磁盘。"""
+    COLUMNS = ('status', 'size', 'mtime', 'attempts', 'remote_path', 'failed_since', 'updated_at', 'sha256', 'copy_of', 'pack')
+    HASH_CACHE_DAYS = 30 # 超过这么多天没用到的哈希缓存在启动时清理
 
-def save_failures(data):
-    try:
-        with open(FAILURE_RECORD_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except: pass
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            self.conn = self._open()
+        except sqlite3.DatabaseError as e:
+            broken = f"{path}.corrupt-{int(time.time())}"
+            logger.error(f"⚠️ [状态库] 数据库损坏 ({e})，已备份为 {os.path.basename(broken)} 并重建")
+            os.replace(path, broken)
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(path + suffix): os.remove(path + suffix)
+            self.conn = self._open()
+        self.rows = {}    # 按更新时间排序 (每次写入都移到末尾)，翻历史记录时从后往前读
+        self.by_hash = {} # sha256 -> 已上传文件的相对路径
+        self.counts = {}  # 状态 -> 文件数
+        for row in self.conn.execute(f"SELECT rel_path, {', '.join(self.COLUMNS)} FROM files ORDER BY updated_at"):
+            self.rows[row[0]] = dict(zip(self.COLUMNS, row[1:]))
+            self.counts[row[1]] = self.counts.get(row[1], 0) + 1
+            if self.rows[row[0]]['status'] == 'uploaded' and row[8]: self.by_hash[row[8]] = row[0]
+        self.conn.execute("DELETE FROM hash_cache WHERE last_used < ?", (time.time() - self.HASH_CACHE_DAYS * 86400,))
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS files (
+            rel_path TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            size INTEGER,
+            mtime REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            remote_path TEXT,
+            failed_since REAL,
+            updated_at REAL NOT NULL
+        )""")
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(files)")}
+        for column in ('sha256', 'copy_of', 'pack'): # 旧版数据库补列
+            if column not in existing: conn.execute(f"ALTER TABLE files ADD COLUMN {column} TEXT")
+        conn.execute("""CREATE TABLE IF NOT EXISTS hash_cache (
+            inode INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            git_sha1 TEXT NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (inode, size, mtime_ns)
+        )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS multipart_sessions (
+            oid TEXT PRIMARY KEY,
+            rel_path TEXT NOT NULL,
+            session TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS multipart_parts (
+            oid TEXT NOT NULL,
+            part INTEGER NOT NULL,
+            etag TEXT NOT NULL,
+            PRIMARY KEY (oid, part)
+        )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS dir_index (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER,
+            names TEXT NOT NULL,
+            subdirs TEXT NOT NULL,
+            rules TEXT NOT NULL
+        )""")
+        conn.execute("PRAGMA quick_check").fetchone()
+        return conn
+
+    def _write(self, rel_path, row):
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO files (rel_path, {', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * (len(self.COLUMNS) + 1))})",
+            (rel_path, *[row.get(c) for c in self.COLUMNS]))
+        old = self.rows.pop(rel_path, None)
+        if old and old.get('sha256') and self.by_hash.get(old['sha256']) == rel_path: del self.by_hash[old['sha256']]
+        if old: self.counts[old['status']] -= 1
+        if row['status'] == 'uploaded' and row.get('sha256'): self.by_hash[row['sha256']] = rel_path
+        self.counts[row['status']] = self.counts.get(row['status'], 0) + 1
+        self.rows[rel_path] = row
+
+    def _update(self, rel_path, new_attempt=False, **changes):
+        with self.lock:
+            row = dict(self.rows.get(rel_path) or {'status': 'pending', 'size': None, 'mtime': None, 'attempts': 0,
+                                                   'remote_path': None, 'failed_since': None})
+            row.update(changes)
+            if new_attempt: row['attempts'] += 1
+            row['updated_at'] = time.time()
+            self._write(rel_path, row)
+
+    def migrate_json(self, history_file, failures_file):
+        """一次性导入旧版 history.json / failures.json，导入后改名为 *.migrated"""
+        for legacy in (history_file, failures_file):
+            if not os.path.exists(legacy): continue
+            try:
+                with open(legacy, 'r', encoding='utf-8') as f: data = json.load(f)
+            except Exception as e:
+                logger.warning(f"⚠️ [状态库] 旧记录 {os.path.basename(legacy)} 无法读取，已跳过: {e}")
+                continue
+            now = time.time()
+            with self.lock:
+                self.conn.execute("BEGIN")
+                if legacy == history_file:
+                    for rel in data:
+                        if rel in self.rows: continue
+                        self._write(rel, {'status': 'uploaded', 'size': None, 'mtime': None, 'attempts': 1,
+                                          'remote_path': None, 'failed_since': None, 'updated_at': now})
+                else:
+                    for rel, since in data.items():
+                        if rel in self.rows: continue
+                        self._write(rel, {'status': 'failed', 'size': None, 'mtime': None, 'attempts': 1,
+                                          'remote_path': None, 'failed_since': since, 'updated_at': now})
+                self.conn.execute("COMMIT")
+            os.replace(legacy, legacy + ".migrated")
+            logger.info(f"📥 [状态库] 已导入旧记录 {os.path.basename(legacy)} ({len(data)} 条)")
+
+    def is_uploaded(self, rel_path, size=None, mtime=None):
+        """记录为已上传。传入 size/mtime 时还要求本地文件和上传时一致；旧版导入的记录没有这两项，只看路径。"""
+        with self.lock:
+            row = self.rows.get(rel_path)
+            if row is None or row['status'] != 'uploaded': return False
+            if size is None or row['size'] is None: return True
+            return row['size'] == size and row['mtime'] == mtime
+
+    def failed_since(self, rel_path):
+        with self.lock:
+            row = self.rows.get(rel_path)
+            return row['failed_since'] if row else None
+
+    def find_by_hash(self, sha256, accept=None):
+        """返回已上传过相同内容的云端路径；accept 用来排除上传到其他仓库的文件"""
+        with self.lock:
+            rel = self.by_hash.get(sha256)
+            if rel is None or (accept and not accept(rel)): return None
+            return self.rows[rel]['remote_path']
+
+    def packed_in(self, rel_path, size, mtime):
+        """文件已打包上传且本地没有改动时，返回所在分片的云端路径"""
+        with self.lock:
+            row = self.rows.get(rel_path)
+            if not row or row['status'] != 'uploaded' or not row.get('pack'): return None
+            return row['pack'] if row['size'] == size and row['mtime'] == mtime else None
+
+    def mark_uploaded(self, rel_path, size, mtime, remote_path, sha256=None, copy_of=None, pack=None):
+        self._update(rel_path, new_attempt=True, status='uploaded', size=size, mtime=mtime,
+                     remote_path=remote_path, failed_since=None, sha256=sha256, copy_of=copy_of, pack=pack)
+
+    def mark_packed(self, items, remote_path):
+        """一个分片里的所有文件在一个事务里记为已上传，items 为 [(相对路径, 大小, 修改时间)]"""
+        with self.lock:
+            now = time.time()
+            self.conn.execute("BEGIN")
+            for rel_path, size, mtime in items:
+                row = dict(self.rows.get(rel_path) or {'attempts': 0})
+                row.update(status='uploaded', size=size, mtime=mtime, attempts=row['attempts'] + 1, remote_path=remote_path,
+                           failed_since=None, updated_at=now, sha256=None, copy_of=None, pack=remote_path)
+                self._write(rel_path, row)
+            self.conn.execute("COMMIT")
+
+    def mark_failed(self, rel_path, size, mtime, remote_path, failed_since):
+        self._update(rel_path, new_attempt=True, status='failed', size=size, mtime=mtime,
+                     remote_path=remote_path, failed_since=failed_since)
+
+    def mark_pending(self, rel_path):
+        self._update(rel_path, status='pending')
+
+    def get_hash(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT sha256, git_sha1 FROM hash_cache WHERE inode = ? AND size = ? AND mtime_ns = ?", key).fetchone()
+            if row: self.conn.execute("UPDATE hash_cache SET last_used = ? WHERE inode = ? AND size = ? AND mtime_ns = ?", (time.time(), *key))
+            return row
+
+    def put_hash(self, key, digest):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO hash_cache (inode, size, mtime_ns, sha256, git_sha1, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                              (*key, *digest, time.time()))
+
+    def get_multipart(self, oid):
+        """返回 (分片会话, {分片号: etag})，没有未完成的会话时返回 (None, {})"""
+        with self.lock:
+            row = self.conn.execute("SELECT session, created_at FROM multipart_sessions WHERE oid = ?", (oid,)).fetchone()
+            if not row: return None, {}
+            session = dict(json.loads(row[0]), created_at=row[1])
+            parts = dict(self.conn.execute("SELECT part, etag FROM multipart_parts WHERE oid = ?", (oid,)).fetchall())
+            return session, parts
+
+    def put_multipart(self, oid, rel_path, session):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO multipart_sessions (oid, rel_path, session, created_at) VALUES (?, ?, ?, ?)",
+                              (oid, rel_path, json.dumps(session), time.time()))
+            self.conn.execute("DELETE FROM multipart_parts WHERE oid = ?", (oid,))
+
+    def save_part(self, oid, part, etag):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO multipart_parts (oid, part, etag) VALUES (?, ?, ?)", (oid, part, etag))
+
+    def drop_multipart(self, oid):
+        with self.lock:
+            self.conn.execute("DELETE FROM multipart_sessions WHERE oid = ?", (oid,))
+            self.conn.execute("DELETE FROM multipart_parts WHERE oid = ?", (oid,))
+
+    def load_dir_index(self, rules):
+        """返回 [(目录, mtime_ns, 文件名列表, 子目录列表)]；过滤规则不同的旧索引直接丢弃"""
+        with self.lock:
+            self.conn.execute("DELETE FROM dir_index WHERE rules != ?", (rules,))
+            return [(path, mtime_ns, json.loads(names), json.loads(subdirs))
+                    for path, mtime_ns, names, subdirs in self.conn.execute("SELECT path, mtime_ns, names, subdirs FROM dir_index")]
+
+    def save_dir_index(self, rules, changed, removed):
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany("INSERT OR REPLACE INTO dir_index (path, mtime_ns, names, subdirs, rules) VALUES (?, ?, ?, ?, ?)",
+                                      [(path, mtime_ns, json.dumps(names), json.dumps(subdirs), rules) for path, mtime_ns, names, subdirs in changed])
+                self.conn.executemany("DELETE FROM dir_index WHERE path = ?", [(p,) for p in removed])
+                self.conn.execute("COMMIT")
+            except:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def history(self, status=None, query='', before=None, limit=50):
+        """从最近更新的开始往前翻，返回 (一页记录, 后面是否还有)。凑够一页就停，不会每次遍历全部记录。
+        before 是上一页最后一条的 (updated_at, 路径)，只返回比它更早的：翻页期间有记录更新挪到最前面，也不会重复或漏掉。"""
+        query = query.lower()
+        items = []
+        with self.lock:
+            for rel_path in reversed(self.rows):
+                row = self.rows[rel_path]
+                if before and (row['updated_at'], rel_path) >= before: continue
+                if status and row['status'] != status: continue
+                if query and query not in rel_path.lower(): continue
+                if len(items) > limit and row['updated_at'] < items[-1]['updated_at']: break # 同一时间的记录先凑齐再排序
+                items.append(dict(row, path=rel_path))
+        items.sort(key=lambda r: (r['updated_at'], r['path']), reverse=True)
+        return items[:limit], len(items) > limit
+
+    def clear_failures(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM files WHERE status = 'failed'")
+            self.rows = {k: v for k, v in self.rows.items() if v['status'] != 'failed'}
+            self.counts.pop('failed', None)
+
+    def close(self):
+        with self.lock:
+            try: self.conn.close()
+            except: pass
+
+def file_mtime(path):
+    try: return os.path.getmtime(path)
+    except: return None
+
+# 🌟 内容哈希：流式计算 SHA-256 (即 Hub 的 LFS oid) 和 git blob sha1，按 (inode, 大小, 修改时间) 缓存
+class ContentHasher:
+    CHUNK = 8 * 1024 * 1024
+
+    def __init__(self, store):
+        self.store = store
+
+    def cached(self, path):
+        """只查缓存，不读文件：没算过 (如从 history.json 导入的记录) 时返回 None"""
+        try:
+            st = os.stat(path)
+            cached = self.store.get_hash((st.st_ino, st.st_size, st.st_mtime_ns))
+            return tuple(cached) if cached else None
+        except: return None
+
+    def digest(self, path):
+        """返回 (sha256, git_sha1)；文件不可读或计算途中被修改时返回 None"""
+        try:
+            st = os.stat(path)
+            key = (st.st_ino, st.st_size, st.st_mtime_ns)
+            cached = self.store.get_hash(key)
+            if cached: return tuple(cached)
+
+            sha256 = hashlib.sha256()
+            git_sha1 = hashlib.sha1(f"blob {st.st_size}\0".encode())
+            buf = bytearray(self.CHUNK)
+            view = memoryview(buf)
+            with open(path, 'rb') as f:
+                while True:
+                    if stop_event.is_set(): return None
+                    n = f.readinto(buf)
+                    if not n: break
+                    sha256.update(view[:n])
+                    git_sha1.update(view[:n])
+
+            st_after = os.stat(path)
+            if (st_after.st_size, st_after.st_mtime_ns) != (st.st_size, st.st_mtime_ns): return None
+            digest = (sha256.hexdigest(), git_sha1.hexdigest())
+            self.store.put_hash(key, digest)
+            return digest
+        except Exception as e:
+            logger.warning(f"⚠️ [哈希] 计算失败: {os.path.basename(path)} ({e})")
+            return None
 
 def safe_int(value, default):
     try:
@@ -106,26 +589,102 @@ def safe_int(value, default):
         return int(value)
     except: return default
 
-def send_email(cfg, title, content):
-    if not cfg.get('email_user') or not cfg.get('email_pass'): return
-    try:
+# 🌟 邮件通知：后台线程发送，上传线程只负责入队，永远不会被慢邮件服务器卡住
+class Notifier:
+    """有界队列 + 复用同一个已登录的 SMTP 连接；窗口期内的多条通知合并成一封汇总邮件"""
+    IDLE_CLOSE = 120 # 连接空闲超过该秒数主动断开，下次发送时重连
+
+    def __init__(self, maxsize=200):
+        self.events = queue.Queue(maxsize=maxsize)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.smtp = None
+        self.smtp_key = None
+        self.last_used = 0
+
+    def submit(self, cfg, title, content):
+        if not cfg.get('email_user') or not cfg.get('email_pass'): return
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="notifier")
+                self.thread.daemon = True
+                self.thread.start()
+        try: self.events.put_nowait((cfg, title, content, time.time()))
+        except queue.Full: logger.warning(f"⚠️ [邮件] 通知队列已满，丢弃: {title}")
+
+    def _run(self):
+        while True:
+            try: first = self.events.get(timeout=self.IDLE_CLOSE)
+            except queue.Empty:
+                self._close()
+                continue
+            batch = [first]
+            deadline = time.time() + max(0, safe_int(first[0].get('email_digest_window'), 60))
+            while True: # 窗口期内继续收集，攒成一封
+                remaining = deadline - time.time()
+                if remaining <= 0: break
+                try: batch.append(self.events.get(timeout=remaining))
+                except queue.Empty: break
+            while True: # 窗口结束时队列里已有的也一并带上
+                try: batch.append(self.events.get_nowait())
+                except queue.Empty: break
+
+            groups = {} # 不同的邮箱配置分开发送
+            for event in batch: groups.setdefault(self._key(event[0]), []).append(event)
+            for events in groups.values():
+                cfg = events[-1][0]
+                if len(events) == 1:
+                    _, title, content, _ = events[0]
+                else:
+                    title = f"NAS通知汇总 ({len(events)} 条)"
+                    content = "<hr>".join(f"<b>{t}</b> <span style='color:gray'>{time.strftime('%H:%M:%S', time.localtime(ts))}</span><br>{c}"
+                                          for _, t, c, ts in events)
+                self._send(cfg, title, content)
+
+    def _key(self, cfg):
+        return (cfg.get('email_host') or "smtp.qq.com", safe_int(cfg.get('email_port'), 465),
+                cfg.get('email_user'), cfg.get('email_pass'), cfg.get('email_to'))
+
+    def _connect(self, cfg):
+        key = self._key(cfg)
+        if self.smtp is not None and self.smtp_key == key:
+            try:
+                if self.smtp.noop()[0] == 250: return self.smtp
+            except: pass
+        self._close()
+        host, port = key[0], key[1]
+        self.smtp = smtplib.SMTP_SSL(host, port, timeout=30)
+        self.smtp.login(cfg['email_user'], cfg['email_pass'])
+        self.smtp_key = key
+        return self.smtp
+
+    def _close(self):
+        if self.smtp is None: return
+        try: self.smtp.quit()
+        except: pass
+        self.smtp = None
+        self.smtp_key = None
+
+    def _send(self, cfg, title, content):
         formatted = content.replace('\n', '<br>')
         time_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
         msg = MIMEText(f"<h3>{title}</h3><p>{formatted}</p><hr><p style='font-size:12px;color:gray'>{time_str} | NAS助手</p>", 'html', 'utf-8')
         msg['From'] = formataddr(("NAS助手", cfg['email_user']))
         msg['To'] = formataddr(("我", cfg['email_to']))
         msg['Subject'] = Header(title, 'utf-8')
-        
-        host = cfg.get('email_host') if cfg.get('email_host') else "smtp.qq.com"
-        port = safe_int(cfg.get('email_port'), 465)
-        
-        smtp = smtplib.SMTP_SSL(host, port, timeout=30)
-        smtp.login(cfg['email_user'], cfg['email_pass'])
-        smtp.sendmail(cfg['email_user'], [cfg['email_to']], msg.as_string())
-        smtp.quit()
-        logger.info(f"📧 [邮件] 发送成功: {title}")
-    except Exception as e:
-        logger.error(f"⚠️ [邮件] 发送失败: {str(e)}")
+        for attempt in range(2): # 复用的连接可能已被服务器断开，重连一次
+            try:
+                self._connect(cfg).sendmail(cfg['email_user'], [cfg['email_to']], msg.as_string())
+                logger.info(f"📧 [邮件] 发送成功: {title}")
+                return
+            except Exception as e:
+                self._close()
+                if attempt == 1: logger.error(f"⚠️ [邮件] 发送失败: {str(e)}")
+
+NOTIFIER = Notifier()
+
+def send_email(cfg, title, content):
+    NOTIFIER.submit(cfg, title, content)
 
 def recursive_delete_empty(path):
     try:
@@ -145,125 +704,1601 @@ def recursive_delete_empty(path):
                 recursive_delete_empty(os.path.dirname(path))
     except: pass
 
-def check_remote_success(api, repo_id, repo_type, remote_path, local_size):
+# 🌟 云端文件索引：批量查询 + 本地缓存，不再每个文件单独发一次 get_paths_info
+class RemoteIndex:
+    """缓存 云端路径 -> (大小, sha256, git blob id)。自己提交成功的文件直接写入缓存，提交失败的文件先作废再重新查询。"""
+    CHUNK = 100            # 每次 get_paths_info 最多查询的路径数
+    TREE_THRESHOLD = 1000  # 一次要查的文件超过这个数，直接列出整个目录树
+    FAIL_TTL = 30          # 查询失败后这么多秒内不再重复查询，避免每个文件各自再查一次
+
+    def __init__(self, repo_id, repo_type, remote_root, ttl):
+        self.repo_id = repo_id
+        self.repo_type = repo_type
+        self.remote_root = remote_root
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {} # 云端路径 -> (大小, sha256, blob_id, 查询时间)，大小为 None 表示云端不存在
+        self.failed = {}  # 云端路径 -> 最近一次查询失败的时间，失败期间按“云端没有”处理
+
+    def _fresh(self, path, now):
+        entry = self.entries.get(path)
+        if entry is not None and now - entry[3] < self.ttl: return True
+        return now - self.failed.get(path, 0) < self.FAIL_TTL
+
+    def prefetch(self, api, paths):
+        now = time.time()
+        with self.lock: missing = [p for p in dict.fromkeys(paths) if not self._fresh(p, now)]
+        if not missing: return
+        done = 0
+        try:
+            if len(missing) > self.TREE_THRESHOLD:
+                self._load_tree(api, missing, now)
+                return
+            for i in range(0, len(missing), self.CHUNK):
+                chunk = missing[i:i + self.CHUNK]
+                METRICS.inc("hf_uploader_remote_requests_total", method="get_paths_info")
+                with METRICS.timer("hf_uploader_remote_request_seconds", method="get_paths_info"):
+                    info = api.get_paths_info(repo_id=self.repo_id, repo_type=self.repo_type, paths=chunk)
+                found = {item.path: self._describe(item) for item in info}
+                with self.lock:
+                    for p in chunk:
+                        self.entries[p] = (*found.get(p, (None, None, None)), now)
+                        self.failed.pop(p, None)
+                done = i + len(chunk)
+        except Exception as e:
+            logger.warning(f"⚠️ [云端] 查询文件信息失败: {e}")
+            with self.lock:
+                for p in missing[done:]: self.failed[p] = now
+
+    def _load_tree(self, api, missing, now):
+        logger.info(f"🌲 [云端] 待核实文件较多 ({len(missing)} 个)，一次性拉取仓库目录树...")
+        found = {}
+        METRICS.inc("hf_uploader_remote_requests_total", method="list_repo_tree")
+        try:
+            with METRICS.timer("hf_uploader_remote_request_seconds", method="list_repo_tree"):
+                for item in api.list_repo_tree(repo_id=self.repo_id, repo_type=self.repo_type,
+                                               path_in_repo=self.remote_root, recursive=True):
+                    if getattr(item, 'size', None) is not None: found[item.path] = self._describe(item)
+        except Exception as e:
+            if getattr(getattr(e, 'response', None), 'status_code', None) != 404: raise
+            found = {} # 云端还没有这个目录：里面的文件都按不存在缓存
+        with self.lock:
+            for p, meta in found.items(): self.entries[p] = (*meta, now)
+            for p in missing:
+                if p not in found: self.entries[p] = (None, None, None, now)
+                self.failed.pop(p, None)
+
+    @staticmethod
+    def _describe(item):
+        lfs = getattr(item, 'lfs', None)
+        return (getattr(item, 'size', None), lfs.sha256 if lfs else None, getattr(item, 'blob_id', None))
+
+    def matches(self, api, remote_path, local_size, digest=None):
+        """云端文件和本地一致：大小相同，且有哈希时 LFS sha256 或 git blob id 也相同。
+        最近一次查询失败、没有可用的结果时返回 None (未知)，调用方不要把它当成云端缺失。"""
+        METRICS.inc("hf_uploader_remote_checks_total")
+        self.prefetch(api, [remote_path])
+        with self.lock:
+            entry = self.entries.get(remote_path)
+            failed_at = self.failed.get(remote_path)
+        if failed_at is not None and (entry is None or entry[3] <= failed_at): return None
+        if entry is None or entry[0] != local_size: return False
+        if digest:
+            if entry[1]: return entry[1] == digest[0]
+            if entry[2]: return entry[2] == digest[1]
+        return True
+
+    def record(self, remote_path, size, digest=None):
+        sha256, git_sha1 = digest if digest else (None, None)
+        with self.lock: self.entries[remote_path] = (size, sha256, git_sha1, time.time())
+
+    def invalidate(self, remote_paths):
+        with self.lock:
+            for p in remote_paths:
+                self.entries.pop(p, None)
+                self.failed.pop(p, None)
+
+def build_remote_path(config, rel):
+    remote_f = config.get('remote_folder', '')
+    if not remote_f or remote_f.strip() == "": remote_f = "."
+    return f"{remote_f}/{rel}" if remote_f != "." else rel
+
+def is_resumable(config, size):
+    threshold = safe_int(config.get('resumable_min_mb'), 1024)
+    return threshold > 0 and size >= threshold * 1024 * 1024
+
+# 🌟 自适应限速：按错误类型区分重试等待，令牌桶控制每分钟 commit 数，Hub 健康时逐步提速
+ERROR_NAMES = {'rate_limit': '限流', 'auth': '鉴权', 'server': '服务器错误', 'network': '网络',
+               'conflict': '提交冲突', 'client': '请求错误', 'local': '本地文件', 'unknown': '未知错误'}
+
+def parse_retry_hint(headers):
+    """服务器建议的等待秒数：Retry-After (秒数或 HTTP 日期)，或 RateLimit 头里的 t=剩余重置时间"""
+    value = headers.get('retry-after') or headers.get('Retry-After')
+    if value:
+        try: return max(0.0, float(value))
+        except ValueError:
+            try: return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except: pass
+    match = re.search(r't\s*=\s*(\d+)', headers.get('ratelimit') or headers.get('RateLimit') or '')
+    return float(match.group(1)) if match else None
+
+def classify_error(exc):
+    """返回 (错误类型, 服务器建议的等待秒数)"""
+    response = getattr(exc, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status:
+        hint = parse_retry_hint(getattr(response, 'headers', None) or {})
+        if status == 429: return 'rate_limit', hint
+        if status in (401, 403): return 'auth', hint
+        if status == 408 or status >= 500: return 'server', hint
+        if status in (409, 412): return 'conflict', hint # 多个线程同时提交到同一分支
+        return 'client', hint
+    if isinstance(exc, (FileNotFoundError, PermissionError, IsADirectoryError)): return 'local', None
+    if isinstance(exc, (ConnectionError, TimeoutError)) or any(
+            word in cls.__name__ for cls in type(exc).__mro__ for word in ('Connect', 'Timeout', 'Transport', 'Network')):
+        return 'network', None
+    err_str = str(exc)
+    if "429" in err_str: return 'rate_limit', None
+    if "401" in err_str: return 'auth', None
+    return 'unknown', None
+
+class RateController:
+    """所有上传线程共用。每次 commit 前取一个令牌；收到 429 时速率减半并让所有线程暂停，之后每次成功再慢慢加回上限。"""
+    BACKOFF = { # 错误类型 -> (首次等待秒数, 最长等待秒数)，每次重试翻倍并加随机抖动
+        'rate_limit': (60, 900), 'server': (10, 600), 'network': (5, 300), 'auth': (5, 60),
+        'conflict': (2, 60), 'client': (30, 300), 'unknown': (30, 900),
+    }
+
+    def __init__(self, config):
+        self.max_rate = max(1, safe_int(config.get('max_commits_per_min'), 10)) / 60.0 # 每秒令牌数
+        self.rate = self.max_rate
+        self.tokens = self.capacity()
+        self.updated = time.time()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+        METRICS.set("hf_uploader_commit_rate_per_min", round(self.rate * 60, 2))
+
+    def capacity(self):
+        return max(1.0, self.rate * 10) # 允许攒 10 秒的突发量
+
+    def configure(self, config):
+        """热更新每分钟提交上限，429 之后的降速比例保留"""
+        with self.lock:
+            max_rate = max(1, safe_int(config.get('max_commits_per_min'), 10)) / 60.0
+            self.rate = min(max_rate, self.rate * max_rate / self.max_rate)
+            self.max_rate = max_rate
+            METRICS.set("hf_uploader_commit_rate_per_min", round(self.rate * 60, 2))
+
+    def acquire(self):
+        """等到可以提交为止；服务停止时返回 False"""
+        while not stop_event.is_set():
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity(), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return True
+                    wait = (1 - self.tokens) / self.rate
+            stop_event.wait(min(wait, 60))
+        return False
+
+    def success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+            METRICS.set("hf_uploader_commit_rate_per_min", round(self.rate * 60, 2))
+
+    def failure(self, exc, attempt):
+        """返回 (错误类型, 重试前等待秒数)；不值得重试时等待秒数为 None"""
+        kind, hint = classify_error(exc)
+        if kind == 'local' or (kind == 'client' and attempt >= 1): return kind, None
+        base, cap = self.BACKOFF[kind]
+        delay = min(cap, base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+        if hint is not None: delay = hint + random.uniform(0, 3) # 服务器给了等待时间就按它来
+        if kind == 'rate_limit':
+            with self.lock:
+                self.rate = max(self.max_rate / 16, self.rate / 2)
+                self.tokens = min(self.tokens, 0)
+                self.paused_until = max(self.paused_until, time.time() + delay)
+                METRICS.set("hf_uploader_commit_rate_per_min", round(self.rate * 60, 2))
+            logger.warning(f"🚥 [限流] Hub 要求放慢，所有线程暂停 {delay:.0f}秒，提交速率降到 {self.rate * 60:.1f} 次/分钟")
+        return kind, delay
+
+# 🌟 批量提交：按文件数和总大小切分，一批文件合并成一次 commit
+def split_batches(tasks, max_files, max_bytes):
+    batches, current, current_bytes = [], [], 0
+    for local_p, rel_p in tasks:
+        try: size = os.path.getsize(local_p)
+        except: continue
+        if current and (len(current) >= max_files or current_bytes + size > max_bytes):
+            batches.append(current)
+            current, current_bytes = [], 0
+        current.append((local_p, rel_p, size))
+        current_bytes += size
+    if current: batches.append(current)
+    return batches
+
+def commit_with_retry(api, config, rate, mode, label, commit, verify):
+    """提交的通用重试流程，返回 (是否成功, api)。commit(api) 执行一次提交；失败后先调用 verify(api) 核对云端，
+    返回 True 说明其实已经传上去了。之后按错误类型等待重试，鉴权失败时重建客户端。"""
+    max_retries = safe_int(config.get('max_retries'), 5)
+    for attempt in range(max_retries):
+        if stop_event.is_set() or not rate.acquire(): break
+        try:
+            commit(api)
+            rate.success()
+            return True, api
+        except Exception as e:
+            kind, delay = rate.failure(e, attempt)
+            logger.info(f"⚠️ {label} 提交失败 ({ERROR_NAMES[kind]})，校验远程状态...")
+            if verify(api): return True, api
+            if delay is None:
+                logger.warning(f"❌ [放弃] {label} 遇到无法重试的错误: {e}")
+                break
+            if attempt + 1 >= max_retries: break
+            METRICS.inc("hf_uploader_retries_total", mode=mode, kind=kind)
+            logger.warning(f"❌ [重试] {label} 第{attempt+1}次失败，休息 {delay:.0f}秒...")
+            stop_event.wait(delay)
+            if kind == 'auth':
+                try: api = HfApi(token=config['hf_token'], endpoint=config.get('hf_endpoint', 'https://hf-mirror.com'))
+                except: pass
+    return False, api
+
+def upload_batch(api, config, batch, remote_index, digests=None, rate=None, limiter=None):
+    """提交一批文件，返回 (成功列表, 失败列表, api)。失败重试时只重传云端仍缺失的文件。"""
+    digests = digests or {}
+    pending = list(batch)
+    done = []
+
+    def commit(api):
+        nonlocal pending
+        operations, ready = [], []
+        for item in pending:
+            local_p, rel_p, _ = item
+            try:
+                operation = CommitOperationAdd(path_in_repo=build_remote_path(config, rel_p), path_or_fileobj=local_p)
+                if digests.get(rel_p): operation.upload_info.sha256 = bytes.fromhex(digests[rel_p][0]) # 已算过哈希，不再重复读文件
+                operations.append(operation)
+                ready.append(item)
+            except Exception as e:
+                logger.warning(f"⚠️ [跳过] 本地文件不可读: {os.path.basename(rel_p)} ({e})")
+        pending = ready
+        if not operations: return
+        readers = throttle_operations(operations, limiter)
+        try:
+            api.create_commit(
+                repo_id=config['repo_id'],
+                repo_type=config['repo_type'],
+                operations=operations,
+                commit_message=f"Upload {len(operations)} files",
+                token=config['hf_token']
+            )
+        finally:
+            for reader in readers: reader.release()
+        done.extend(pending)
+        pending = []
+
+    def verify(api): # 逐个核对，只留下云端仍缺失的文件
+        nonlocal pending
+        still_missing = []
+        remote_paths = [build_remote_path(config, item[1]) for item in pending]
+        remote_index.invalidate(remote_paths)
+        remote_index.prefetch(api, remote_paths)
+        for item, remote_p in zip(pending, remote_paths):
+            if remote_index.matches(api, remote_p, item[2], digests.get(item[1])): done.append(item)
+            else: still_missing.append(item)
+        if len(still_missing) < len(pending):
+            logger.info(f"🎉 [捡漏] {len(pending) - len(still_missing)} 个文件远程已存在，视为成功！")
+        pending = still_missing
+        return not pending
+
+    _, api = commit_with_retry(api, config, rate or RateController(config), "batch", f"批量 ({len(batch)} 个文件)", commit, verify)
+
+    done_rels = {item[1] for item in done}
+    failed = [item for item in batch if item[1] not in done_rels]
+    return done, failed, api
+
+# 🌟 大文件断点续传：LFS multipart 分片上传，已完成的分片记在状态库里，重试或重启后从断点继续
+MULTIPART_SESSION_TTL = 20 * 3600 # 预签名分片地址有效期有限，会话超过这个时间重新申请
+
+def format_size(num):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if num < 1024: return f"{num:.1f} {unit}"
+        num /= 1024
+    return f"{num:.1f} TB"
+
+def format_eta(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600: return f"{seconds // 3600}时{seconds % 3600 // 60}分"
+    if seconds >= 60: return f"{seconds // 60}分{seconds % 60}秒"
+    return f"{seconds}秒"
+
+class TransferProgress:
+    """大文件上传进度：每隔 INTERVAL 秒把已发送字节、速度和预计剩余时间写入日志"""
+    INTERVAL = 10
+
+    def __init__(self, name, total, already=0):
+        self.name = name
+        self.total = total
+        self.sent = already
+        self.resumed_from = already
+        self.started = time.time()
+        self.last_log = self.started
+        self.lock = threading.Lock()
+        self.tid = STATUS.current() # 分片由线程池并发发送，先记下所属任务
+        STATUS.progress(self.tid, already, resumed_from=already)
+
+    def advance(self, nbytes):
+        with self.lock:
+            self.sent += nbytes
+            STATUS.progress(self.tid, self.sent)
+            now = time.time()
+            if now - self.last_log < self.INTERVAL and self.sent < self.total: return
+            self.last_log = now
+            speed = (self.sent - self.resumed_from) / max(now - self.started, 0.001)
+            eta = format_eta((self.total - self.sent) / speed) if speed > 0 else "未知"
+        percent = self.sent * 100 / max(self.total, 1)
+        logger.info(f"📶 [进度] {self.name} {percent:.1f}% | {format_size(self.sent)}/{format_size(self.total)} | {speed / (1024*1024):.1f} MB/s | 剩余 {eta}")
+
+def fix_endpoint_url(url, endpoint):
+    if not url: return url
+    return url.replace("https://huggingface.co", endpoint.rstrip('/')) if endpoint else url
+
+def upload_resumable(api, config, store, local_p, rel_p, size, digest, limiter=None):
+    """先按 LFS 协议分片上传文件内容，再提交一个引用该 oid 的 commit"""
+    oid = digest[0]
+    file_name = os.path.basename(rel_p)
+    session, parts_done = store.get_multipart(oid)
+    if session and time.time() - session['created_at'] > MULTIPART_SESSION_TTL:
+        store.drop_multipart(oid)
+        session, parts_done = None, {}
+
+    if session is None:
+        with open(local_p, 'rb') as f: sample = f.read(512)
+        info = UploadInfo(size=size, sample=sample, sha256=bytes.fromhex(oid))
+        actions, errors, _ = post_lfs_batch_info([info], token=config['hf_token'], repo_type=config['repo_type'],
+                                                 repo_id=config['repo_id'], endpoint=api.endpoint)
+        if errors: raise ValueError(f"LFS 申请上传失败: {errors[0]['error']['message']}")
+        lfs_actions = actions[0].get('actions') if actions else None
+        if lfs_actions:
+            upload, verify = lfs_actions['upload'], lfs_actions.get('verify') or {}
+            header = upload.get('header') or {}
+            session = {
+                'chunk_size': safe_int(header.get('chunk_size'), 0),
+                'part_urls': [url for _, url in sorted((int(k), v) for k, v in header.items() if k.isdigit())],
+                'upload_url': fix_endpoint_url(upload['href'], api.endpoint),
+                'verify_url': fix_endpoint_url(verify.get('href'), api.endpoint),
+            }
+            store.put_multipart(oid, rel_p, session)
+        else:
+            logger.info(f"☁️ [秒传] 云端已有 {file_name} 的内容，直接提交")
+    elif parts_done:
+        logger.info(f"⏯️ [续传] {file_name} 已完成 {len(parts_done)}/{len(session['part_urls'])} 个分片，从断点继续")
+
+    if session:
+        if session['chunk_size'] and session['part_urls']:
+            _upload_parts(config, store, oid, local_p, size, session, parts_done, file_name, limiter)
+        else:
+            _upload_whole(local_p, size, session, file_name, limiter)
+        if session.get('verify_url'):
+            resp = http_backoff("POST", session['verify_url'], headers=build_hf_headers(token=config['hf_token']),
+                                json={"oid": oid, "size": size})
+            hf_raise_for_status(resp)
+        store.drop_multipart(oid)
+
+    # 内容已在 LFS 存储里，告诉 huggingface_hub 跳过上传阶段，也不用再算一遍 sha256。
+    # _upload_mode / _is_uploaded 是 CommitOperationAdd 的私有属性 (没有公开的接口)，升级 huggingface_hub 大版本时要核对；
+    # 上面 http_backoff 的 content= 也依赖 1.x 起基于 httpx 的客户端，版本范围见 requirements.txt
+    operation = CommitOperationAdd(path_in_repo=build_remote_path(config, rel_p), path_or_fileobj=local_p)
+    operation.upload_info.sha256 = bytes.fromhex(oid)
+    operation._upload_mode = "lfs"
+    operation._is_uploaded = True
+    api.create_commit(
+        repo_id=config['repo_id'],
+        repo_type=config['repo_type'],
+        operations=[operation],
+        commit_message=f"Upload {rel_p}",
+        token=config['hf_token']
+    )
+
+def _upload_parts(config, store, oid, local_p, size, session, parts_done, file_name, limiter=None):
+    chunk_size, part_urls = session['chunk_size'], session['part_urls']
+    progress = TransferProgress(file_name, size, sum(min(chunk_size, size - (n - 1) * chunk_size) for n in parts_done))
+
+    def send(part):
+        if stop_event.is_set(): return
+        with open(local_p, 'rb') as f:
+            f.seek((part - 1) * chunk_size)
+            data = f.read(chunk_size)
+        if limiter and limiter.rate > 0:
+            resp = http_backoff("PUT", part_urls[part - 1], content=ThrottledBytes(data, limiter))
+        else:
+            resp = http_backoff("PUT", part_urls[part - 1], content=data)
+        if resp.status_code in (403, 404): store.drop_multipart(oid) # 分片地址已过期，下次重新申请
+        hf_raise_for_status(resp)
+        etag = resp.headers.get('etag')
+        if not etag: raise ValueError(f"分片 {part} 未返回 etag")
+        store.save_part(oid, part, etag)
+        parts_done[part] = etag
+        progress.advance(len(data))
+
+    pending = [n for n in range(1, len(part_urls) + 1) if n not in parts_done]
+    if config.get('enable_hf_transfer', False): # 高速模式：多个分片并行发送
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            for future in [executor.submit(send, n) for n in pending]: future.result()
+    else:
+        for n in pending: send(n)
+    if stop_event.is_set(): raise InterruptedError("服务停止，分片上传暂停")
+
+    resp = http_backoff("POST", session['upload_url'], headers=LFS_HEADERS,
+                        json={"oid": oid, "parts": [{"partNumber": n, "etag": parts_done[n]} for n in sorted(parts_done)]})
+    hf_raise_for_status(resp)
+
+def _upload_whole(local_p, size, session, file_name, limiter=None):
+    progress = TransferProgress(file_name, size)
+
+    def stream():
+        with open(local_p, 'rb') as f:
+            throttled = limiter.wrap(f) if limiter else f
+            while True:
+                data = throttled.read(1024 * 1024 if throttled is not f else 8 * 1024 * 1024)
+                if not data: break
+                progress.advance(len(data))
+                yield data
+
+    resp = http_backoff("PUT", session['upload_url'], content=stream(), headers={"Content-Length": str(size)}, max_retries=0)
+    hf_raise_for_status(resp)
+
+def upload_single(api, config, local_p, rel_p, size, remote_index, digest=None, store=None, rate=None, limiter=None):
+    """上传单个文件，返回 (是否成功, api)。传入 store 和 digest 且文件足够大时走分片断点续传。"""
+    remote_p = build_remote_path(config, rel_p)
+    resumable = store is not None and digest is not None and is_resumable(config, size)
+
+    def commit(api):
+        if resumable: return upload_resumable(api, config, store, local_p, rel_p, size, digest, limiter)
+        operation = CommitOperationAdd(path_in_repo=remote_p, path_or_fileobj=local_p)
+        if digest: operation.upload_info.sha256 = bytes.fromhex(digest[0]) # 已算过哈希，不再重复读文件
+        readers = throttle_operations([operation], limiter)
+        try:
+            api.create_commit(
+                repo_id=config['repo_id'],
+                repo_type=config['repo_type'],
+                operations=[operation],
+                commit_message=f"Upload {rel_p}",
+                token=config['hf_token']
+            )
+        finally:
+            for reader in readers: reader.release()
+
+    def verify(api):
+        remote_index.invalidate([remote_p])
+        if not remote_index.matches(api, remote_p, size, digest): return False
+        logger.info(f"🎉 [捡漏] 远程文件已存在，视为成功！")
+        return True
+
+    return commit_with_retry(api, config, rate or RateController(config), "single", os.path.basename(rel_p), commit, verify)
+
+def copy_remote(api, config, copies, rate=None):
+    """云端已有相同内容的文件直接在服务器端复制，不再传输数据。copies 为 [(任务, 云端源路径)]"""
+    operations = [CommitOperationCopy(src_path_in_repo=src, path_in_repo=build_remote_path(config, item[1])) for item, src in copies]
+    rate = rate or RateController(config)
+    if not rate.acquire(): return False
     try:
-        info = api.get_paths_info(
-            repo_id=repo_id,
-            repo_type=repo_type,
-            paths=[remote_path],
+        api.create_commit(
+            repo_id=config['repo_id'],
+            repo_type=config['repo_type'],
+            operations=operations,
+            commit_message=f"Copy {len(operations)} duplicate files",
+            token=config['hf_token']
         )
-        if len(info) > 0:
-            if info[0].size == local_size: return True
-    except:
+        rate.success()
+        logger.info(f"♻️ [去重] {len(operations)} 个文件内容云端已存在，已在服务器端复制")
+        return True
+    except Exception as e:
+        rate.failure(e, 0) # 只为记录限流信号，失败的文件交给正常上传重试
+        logger.warning(f"⚠️ [去重] 服务器端复制失败，改为正常上传: {e}")
         return False
-    return False
 
-# 🌟 V40 核心：文件夹稳定性校验
-def check_folder_stability(folder_path, duration):
-    logger.info(f"🛡️ [校验] 正在检查文件完整性，请等待 {duration}秒...")
-    snapshot1 = {}
+def handle_upload_success(config, local_p, rel_p, size_mb):
+    logger.info(f"✅ [成功] 任务完成: {os.path.basename(rel_p)}")
+    if size_mb >= safe_int(config.get('notify_min_size'), 1024):
+        send_email(config, "大文件上传成功", f"文件: {rel_p}")
+
+    if config.get('delete_after_upload', True):
+        try:
+            os.remove(local_p)
+            logger.info(f"🗑️ [删除] 本地文件: {os.path.basename(rel_p)}")
+            recursive_delete_empty(os.path.dirname(local_p))
+        except: pass
+
+def handle_upload_failure(config, store, local_p, rel_p, size):
+    logger.error(f"⛔ [失败] 放弃上传: {os.path.basename(rel_p)}")
+    current_time = time.time()
+    since = store.failed_since(rel_p)
+    if since is None:
+        since = current_time
+    elif (current_time - since) > 86400:
+        send_email(config, "严重：文件失败超24小时", f"文件: {rel_p}")
+        since = current_time
+    store.mark_failed(rel_p, size, file_mtime(local_p), build_remote_path(config, rel_p), since)
+
+# 🌟 小文件打包：文件多的文件夹直接从磁盘流式拼成 tar / zip 分片上传，不生成临时文件
+class PackedShard(io.BufferedIOBase):
+    """只读、可 seek 的虚拟归档。由若干段拼成：内存里的头部字节 + 磁盘文件的原始内容，读到哪段就从哪里取。
+    zip 使用 stored + 数据描述符，CRC 在第一次顺序读取 (Hub 计算 sha256) 时顺带算出。"""
+    FORMATS = ('tar', 'zip')
+    ZIP_MAX_BYTES = 4000 * 1024 * 1024 # 不使用 zip64，分片大小和条目数都留足余量
+    ZIP_MAX_FILES = 60000
+
+    def __init__(self, fmt, members):
+        super().__init__()
+        self.fmt = fmt
+        self.members = members # [(本地路径, 相对路径, 大小, 修改时间)]
+        self.segments = []     # [(起始偏移, 长度, bytes / 成员序号 / 延迟生成函数)]
+        self.starts = []
+        self.offsets = []      # 每个成员的数据在分片里的偏移
+        self.size = 0
+        self.pos = 0
+        self.handle = None     # (成员序号, 文件对象)
+        self.crc = [0] * len(members)
+        self.crc_pos = [0] * len(members)
+        if fmt == 'zip': self._layout_zip()
+        else: self._layout_tar()
+
+    def _add(self, length, payload):
+        self.segments.append((self.size, length, payload))
+        self.starts.append(self.size)
+        self.size += length
+
+    def _layout_tar(self):
+        for i, (_, rel_p, size, mtime) in enumerate(self.members):
+            info = tarfile.TarInfo(rel_p)
+            info.size, info.mtime, info.mode = size, int(mtime), 0o644
+            header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+            self._add(len(header), header)
+            self.offsets.append(self.size)
+            self._add(size, i)
+            if size % 512: self._add(512 - size % 512, b"\0" * (512 - size % 512))
+        self._add(1024, b"\0" * 1024)
+
+    @staticmethod
+    def _dos_time(mtime):
+        t = time.localtime(max(mtime, 315532800 + 86400)) # zip 时间最早 1980 年
+        return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+    def _layout_zip(self):
+        local = []
+        for i, (_, rel_p, size, mtime) in enumerate(self.members):
+            name = rel_p.encode('utf-8', 'surrogateescape')
+            dos_time, dos_date = self._dos_time(mtime)
+            local.append(self.size)
+            # 标志 0x0808：UTF-8 文件名 + CRC/大小写在数据后面的描述符里
+            header = struct.pack('<4s5H3L2H', b'PK\x03\x04', 20, 0x0808, 0, dos_time, dos_date, 0, 0, 0, len(name), 0) + name
+            self._add(len(header), header)
+            self.offsets.append(self.size)
+            self._add(size, i)
+            self._add(16, lambda i=i: struct.pack('<4s3L', b'PK\x07\x08', self._crc(i), self.members[i][2], self.members[i][2]))
+        cd_offset = self.size
+        cd_size = sum(46 + len(m[1].encode('utf-8', 'surrogateescape')) for m in self.members)
+
+        def central():
+            out = []
+            for i, (_, rel_p, size, mtime) in enumerate(self.members):
+                name = rel_p.encode('utf-8', 'surrogateescape')
+                dos_time, dos_date = self._dos_time(mtime)
+                out.append(struct.pack('<4s6H3L5H2L', b'PK\x01\x02', 0x0314, 20, 0x0808, 0, dos_time, dos_date,
+                                       self._crc(i), size, size, len(name), 0, 0, 0, 0, 0o100644 << 16, local[i]) + name)
+            count = len(self.members)
+            out.append(struct.pack('<4s4H2LH', b'PK\x05\x06', 0, 0, count, count, cd_size, cd_offset, 0))
+            return b"".join(out)
+        self._add(cd_size + 22, central)
+
+    def _open_member(self, i):
+        if self.handle and self.handle[0] == i: return self.handle[1]
+        if self.handle: self.handle[1].close()
+        f = open(self.members[i][0], 'rb')
+        self.handle = (i, f)
+        if os.fstat(f.fileno()).st_size != self.members[i][2]:
+            raise OSError(f"文件在打包过程中被修改: {self.members[i][1]}")
+        return f
+
+    def _read_member(self, i, skip, want):
+        f = self._open_member(i)
+        f.seek(skip)
+        chunk = f.read(want)
+        if len(chunk) != want: raise OSError(f"文件在打包过程中被修改: {self.members[i][1]}")
+        if self.fmt == 'zip' and skip == self.crc_pos[i]:
+            self.crc[i] = zlib.crc32(chunk, self.crc[i])
+            self.crc_pos[i] += len(chunk)
+        return chunk
+
+    def _crc(self, i):
+        size = self.members[i][2]
+        while self.crc_pos[i] < size: # 没有顺序读过的成员 (如直接 seek 到末尾) 补算 CRC
+            self._read_member(i, self.crc_pos[i], min(1024 * 1024, size - self.crc_pos[i]))
+        return self.crc[i]
+
+    def manifest(self, shard_name):
+        return {"format": self.fmt, "shard": shard_name, "created": int(time.time()),
+                "files": [{"path": rel_p, "offset": offset, "size": size, "mtime": mtime}
+                          for (_, rel_p, size, mtime), offset in zip(self.members, self.offsets)]}
+
+    def readable(self): return True
+    def seekable(self): return True
+    def tell(self): return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR: offset += self.pos
+        elif whence == io.SEEK_END: offset += self.size
+        self.pos = max(0, offset)
+        return self.pos
+
+    def read(self, n=-1):
+        end = self.size if n is None or n < 0 else min(self.size, self.pos + n)
+        out = []
+        while self.pos < end:
+            idx = bisect.bisect_right(self.starts, self.pos) - 1
+            start, length, payload = self.segments[idx]
+            skip = self.pos - start
+            want = min(length - skip, end - self.pos)
+            if isinstance(payload, int):
+                chunk = self._read_member(payload, skip, want)
+            else:
+                if callable(payload):
+                    payload = payload()
+                    self.segments[idx] = (start, length, payload)
+                chunk = payload[skip:skip + want]
+            out.append(chunk)
+            self.pos += len(chunk)
+        return b"".join(out)
+
+    read1 = read
+
+    def close(self):
+        if self.handle:
+            self.handle[1].close()
+            self.handle = None
+        super().close()
+
+def split_packs(tasks, fmt, shard_mb):
+    """返回 (分片列表, 不打包的单文件任务)。超过分片大小的文件和凑不成分片的零头照常逐个上传。"""
+    max_bytes = max(1, shard_mb) * 1024 * 1024
+    max_files = len(tasks)
+    if fmt == 'zip': max_bytes, max_files = min(max_bytes, PackedShard.ZIP_MAX_BYTES), PackedShard.ZIP_MAX_FILES
+    packs, singles = [], []
+    for batch in split_batches(tasks, max_files, max_bytes):
+        (packs if len(batch) > 1 else singles).append(batch)
+    return packs, singles
+
+def upload_pack(api, config, shard, remote_p, remote_index, rate=None, limiter=None):
+    """分片和它的 manifest 放在同一个 commit 里提交，返回 (是否成功, api)"""
+    manifest = json.dumps(shard.manifest(os.path.basename(remote_p)), ensure_ascii=False, indent=1).encode('utf-8')
     try:
-        for root, _, files in os.walk(folder_path):
-            for f in files:
-                p = os.path.join(root, f)
-                snapshot1[p] = {'size': os.path.getsize(p), 'mtime': os.path.getmtime(p)}
-        
-        time.sleep(duration)
-        
-        snapshot2 = {}
-        for root, _, files in os.walk(folder_path):
-            for f in files:
-                p = os.path.join(root, f)
-                snapshot2[p] = {'size': os.path.getsize(p), 'mtime': os.path.getmtime(p)}
-        
-        if len(snapshot1) != len(snapshot2): return False
-        for p, meta in snapshot1.items():
-            if p not in snapshot2: return False
-            if meta['size'] != snapshot2[p]['size'] or meta['mtime'] != snapshot2[p]['mtime']:
-                logger.info(f"⏳ [写入中] 文件变化: {os.path.basename(p)}")
-                return False
+        # 构造时 Hub 顺序读一遍分片算 sha256 (zip 的 CRC 也在这一遍里算好)，重试时不再重复读
+        operations = [CommitOperationAdd(path_in_repo=remote_p, path_or_fileobj=shard),
+                      CommitOperationAdd(path_in_repo=f"{remote_p}.manifest.json", path_or_fileobj=manifest)]
+    except Exception as e:
+        logger.warning(f"⚠️ [打包] {os.path.basename(remote_p)} 读取失败: {e}")
+        return False, api
+    digest = (operations[0].upload_info.sha256.hex(), None) # 核对云端时比较分片的 sha256，不只比大小
+    throttle_operations(operations, limiter) # 算完哈希再套限速，分片本身由调用方关闭
+
+    def commit(api):
+        shard.seek(0)
+        api.create_commit(
+            repo_id=config['repo_id'],
+            repo_type=config['repo_type'],
+            operations=operations,
+            commit_message=f"Upload pack {os.path.basename(remote_p)} ({len(shard.members)} files)",
+            token=config['hf_token']
+        )
+
+    def verify(api):
+        remote_index.invalidate([remote_p])
+        if not remote_index.matches(api, remote_p, shard.size, digest): return False
+        logger.info(f"🎉 [捡漏] 远程分片已存在，视为成功！")
         return True
-    except: return False
 
-def uploader_daemon(config):
-    global is_running
-    endpoint = config.get('hf_endpoint', 'https://hf-mirror.com')
-    use_accel = config.get('enable_hf_transfer', False)
-    mode_str = "🚀 高速模式" if use_accel else "🐢 稳定模式"
-    
-    logger.info(f"🚀 服务启动 | 目标: {endpoint} | {mode_str}")
-    
-    os.environ["HF_ENDPOINT"] = endpoint
-    if use_accel:
+    return commit_with_retry(api, config, rate or RateController(config), "pack", f"分片 {os.path.basename(remote_p)}", commit, verify)
+
+# 🌟 并发上传：优先级队列 + 多个上传线程，可选全局限速
+class BandwidthLimiter:
+    """全局限速 (字节/秒)：所有线程发送的数据共用一个令牌桶，按实际读出的字节数计费，读得太快就在读取时等待"""
+    BURST = 1.0 # 空闲时最多攒 1 秒的额度
+
+    def __init__(self, rate):
+        self.rate = rate # 热更新时直接改这个值
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.updated = time.time()
+
+    def throttle(self, nbytes):
+        """发送 nbytes 前调用，超出速率时阻塞到额度够为止；服务停止时立即返回"""
+        rate = self.rate
+        if rate <= 0 or nbytes <= 0: return
+        with self.lock:
+            now = time.time()
+            self.tokens = min(rate * self.BURST, self.tokens + (now - self.updated) * rate) - nbytes
+            self.updated = now
+            wait = -self.tokens / rate
+        if wait > 0: stop_event.wait(wait)
+
+    def wrap(self, fileobj):
+        return ThrottledReader(fileobj, self) if self.rate > 0 else fileobj
+
+class ThrottledReader(io.BufferedIOBase):
+    """包一层文件对象，每次 read 都从限速器扣额度。HTTP 库按 64KB 读取，所以发送速率是平滑的，不会先等后猛发。
+    传入路径时第一次 read 才打开文件、读到末尾就关掉：一批几百个文件也不会同时占着几百个句柄。"""
+    def __init__(self, source, limiter):
+        super().__init__()
+        self.path = source if isinstance(source, str) else None
+        self.fileobj = None if self.path else source
+        self.limiter = limiter
+        self.pos = 0 # 文件没打开时记住的读取位置
+
+    def readable(self): return True
+    def seekable(self): return True
+    def tell(self): return self.fileobj.tell() if self.fileobj else self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if self.fileobj: return self.fileobj.seek(offset, whence)
+        if whence == io.SEEK_CUR: offset += self.pos
+        elif whence == io.SEEK_END: offset += os.path.getsize(self.path)
+        self.pos = max(0, offset)
+        return self.pos
+
+    def read(self, n=-1):
+        if self.fileobj is None:
+            self.fileobj = open(self.path, 'rb')
+            self.fileobj.seek(self.pos)
+        data = self.fileobj.read(n)
+        self.limiter.throttle(len(data))
+        if self.path and (n is None or n < 0 or len(data) < n): self.release() # 读完了
+        return data
+
+    read1 = read
+
+    def release(self):
+        """关掉自己打开的文件，之后再读会从原位置重新打开"""
+        if self.path and self.fileobj:
+            self.pos = self.fileobj.tell()
+            self.fileobj.close()
+            self.fileobj = None
+
+class ThrottledBytes:
+    """限速发送一段内存里的数据 (给 httpx 的 content=)。每次迭代都从头发，http_backoff 重试时不会发出半截；
+    tell/seek 只用来让 httpx 算出 Content-Length (分片地址不接受 chunked)。"""
+    CHUNK = 64 * 1024
+
+    def __init__(self, data, limiter):
+        self.data = data
+        self.limiter = limiter
+
+    def tell(self): return 0
+    def seek(self, offset, whence=io.SEEK_SET): return len(self.data) + offset if whence == io.SEEK_END else offset
+
+    def __iter__(self):
+        view = memoryview(self.data)
+        for i in range(0, len(view), self.CHUNK):
+            chunk = view[i:i + self.CHUNK]
+            self.limiter.throttle(len(chunk))
+            yield bytes(chunk)
+
+def throttle_operations(operations, limiter):
+    """开启限速时把 commit 里要上传的内容换成限速读取的文件对象，返回用完要 release 的读取器 (文件在读取时才打开)。
+    必须在 upload_info 算好之后调用：计算哈希直接读磁盘，不受限速影响。"""
+    readers = []
+    if limiter is None or limiter.rate <= 0: return readers
+    for op in operations:
+        if not isinstance(op, CommitOperationAdd): continue
+        if isinstance(op.path_or_fileobj, str):
+            op.path_or_fileobj = ThrottledReader(op.path_or_fileobj, limiter)
+            readers.append(op.path_or_fileobj)
+        elif isinstance(op.path_or_fileobj, io.BufferedIOBase):
+            op.path_or_fileobj = ThrottledReader(op.path_or_fileobj, limiter)
+    return readers
+
+class UploadPool:
+    """上传线程池，每个上传目标一个。任务按大小排优先级 (小文件优先)，上传状态统一写入 StateStore。"""
+    def __init__(self, api, config, store, remote_index, name="默认", limiter=None, router=None):
+        self.api = api
+        self.config = config
+        self.store = store
+        self.remote_index = remote_index
+        self.name = name
+        self.router = router
+        self.hasher = ContentHasher(store)
+        self.lock = threading.Lock()
+        self.jobs = queue.PriorityQueue()
+        self.seq = 0
+        self.inflight = set() # 已排队或正在上传的相对路径
+        self.folders = {}     # 文件夹 -> {'remaining': 剩余任务数, 'success': 成功文件数}
+        self.limiter = limiter or BandwidthLimiter(max(0, safe_int(config.get('max_upload_mbps'), 0)) * 1024 * 1024)
+        self.rate = RateController(config)
+        self.workers = {}       # 线程序号 -> 线程
+        self.worker_count = 0   # 序号超出这个数的线程传完手上的任务后退出
+        self.retired = False    # 目标已从配置中删除：队列清空后所有线程退出
+
+    def start(self):
+        count = max(1, safe_int(self.config.get('upload_workers'), 1))
+        with self.lock: self.worker_count = count
+        started = 0
+        for i in range(count):
+            if i in self.workers and self.workers[i].is_alive(): continue
+            t = threading.Thread(target=self._worker, args=(i,), name=f"uploader-{self.name}-{i+1}")
+            t.daemon = True
+            t.start()
+            self.workers[i] = t
+            started += 1
+        if started and count > 1: logger.info(f"🧵 [并发] {self.name}: {count} 个上传线程")
+
+    def configure(self, api, config, remote_index, router):
+        """热更新：新配置从下一个任务开始生效，正在上传的任务继续用旧配置传完"""
+        with self.lock:
+            self.api, self.config, self.remote_index, self.router = api, config, remote_index, router
+        self.rate.configure(config)
+        self.start()
+
+    def retire(self):
+        with self.lock: self.retired = True
+
+    def alive(self):
+        return any(t.is_alive() for t in self.workers.values())
+
+    def join(self):
+        for t in list(self.workers.values()): t.join()
+
+    def busy(self):
+        with self.lock: return bool(self.inflight)
+
+    def is_inflight(self, rel_p):
+        with self.lock: return rel_p in self.inflight
+
+    def folder_busy(self, folder_name):
+        with self.lock: return folder_name in self.folders
+
+    def submit_folder(self, folder_name, tasks):
+        tasks.sort(key=lambda x: x[1])
+        packs, jobs = [], []
+        pack_mode = self.config.get('pack_mode', 'off')
+        if pack_mode in PackedShard.FORMATS and len(tasks) >= max(1, safe_int(self.config.get('pack_min_files'), 1000)):
+            packs, jobs = split_packs(tasks, pack_mode, safe_int(self.config.get('pack_shard_mb'), 512))
+            if packs: logger.info(f"🗜️ [打包] {folder_name}: {sum(len(b) for b in packs)} 个文件打成 {len(packs)} 个 {pack_mode} 分片")
+        elif self.config.get('enable_batch_commit', False):
+            jobs = split_batches(tasks, max(1, safe_int(self.config.get('batch_max_files'), 50)),
+                                 max(1, safe_int(self.config.get('batch_max_mb'), 1024)) * 1024 * 1024)
+        else:
+            jobs = split_batches(tasks, 1, 1)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        jobs = [(batch, None) for batch in jobs]
+        for n, batch in enumerate(packs, 1):
+            shard_name = f"pack-{stamp}-{n:05d}.{pack_mode}"
+            jobs.append((batch, shard_name if folder_name == "根目录" else f"{folder_name}/{shard_name}"))
+        if not jobs: return
+        with self.lock:
+            self.folders[folder_name] = {'remaining': len(jobs), 'success': 0, 'active': 0, 'queued': time.time(),
+                                         'files': sum(len(b) for b, _ in jobs), 'bytes': sum(item[2] for b, _ in jobs for item in b)}
+            for batch, shard_rel in jobs:
+                self.inflight.update(item[1] for item in batch)
+                self.seq += 1
+                self.jobs.put((sum(item[2] for item in batch), self.seq, folder_name, batch, shard_rel))
+            self._update_gauges()
+
+    def _update_gauges(self):
+        METRICS.set("hf_uploader_pending_files", len(self.inflight), target=self.name)
+        METRICS.set("hf_uploader_pending_jobs", self.jobs.qsize(), target=self.name)
+
+    def queue_status(self):
+        with self.lock:
+            return [{"folder": folder, "target": self.name, "state": "uploading" if t['active'] else "queued",
+                     "files": t['files'], "bytes": t['bytes'], "jobs_left": t['remaining'], "done": t['success'], "since": t['queued']}
+                    for folder, t in self.folders.items()]
+
+    def owns(self, rel_p):
+        return self.router is None or self.router.route(rel_p) == self.name
+
+    def _worker(self, index):
+        while not stop_event.is_set():
+            with self.lock:
+                if index >= self.worker_count or (self.retired and self.jobs.empty()): break
+            try: _, _, folder_name, batch, shard_rel = self.jobs.get(timeout=1)
+            except queue.Empty: continue
+            METRICS.set("hf_uploader_pending_jobs", self.jobs.qsize(), target=self.name)
+            with self.lock:
+                if folder_name in self.folders: self.folders[folder_name]['active'] += 1
+            name = os.path.basename(shard_rel or batch[0][1]) if shard_rel or len(batch) == 1 else f"{len(batch)} 个文件"
+            tid = STATUS.start_transfer(target=self.name, folder=folder_name, name=name, files=len(batch),
+                                        bytes=sum(item[2] for item in batch), mode="pack" if shard_rel else "batch" if len(batch) > 1 else "single")
+            success = 0
+            try:
+                success = self._run_pack(batch, shard_rel) if shard_rel else self._run_job(batch)
+            except Exception as e:
+                logger.error(f"⚠️ 系统错误: {e}")
+            finally:
+                STATUS.end_transfer(tid)
+                self._job_done(folder_name, batch, success)
+
+    def _run_job(self, batch):
+        with self.lock: config, api, remote_index = self.config, self.api, self.remote_index # 一个任务内配置不变
+        start_api = api
+        digests, copies, skipped, uploads = {}, [], [], list(batch)
+        if config.get('enable_dedup', True):
+            uploads, candidates = [], []
+            remote_index.prefetch(api, [build_remote_path(config, item[1]) for item in batch]) # 扫描时已整批查过，缓存有效时不发请求
+            for item in batch:
+                local_p, rel_p, size = item
+                digest = self.hasher.digest(local_p)
+                if stop_event.is_set(): return 0
+                if digest is None:
+                    uploads.append(item)
+                    continue
+                digests[rel_p] = digest
+                remote_p = build_remote_path(config, rel_p)
+                source = self.store.find_by_hash(digest[0], self.owns)
+                if remote_index.matches(api, remote_p, size, digest): skipped.append(item)
+                elif source and source != remote_p: candidates.append((item, source))
+                else: uploads.append(item)
+            if candidates: # 源文件可能已在别处被改掉或删除，云端内容核实无误才在服务器端复制
+                remote_index.prefetch(api, [source for _, source in candidates])
+                for item, source in candidates:
+                    if remote_index.matches(api, source, item[2], digests[item[1]]): copies.append((item, source))
+                    else: uploads.append(item)
+
+        for local_p, rel_p, size in batch: # 断点续传按 oid 记录分片，没开去重时大文件也要先算哈希
+            if rel_p in digests or not is_resumable(config, size): continue
+            digest = self.hasher.digest(local_p)
+            if stop_event.is_set(): return 0
+            if digest: digests[rel_p] = digest
+
+        done, failed, copy_of = [], [], {}
+        if skipped:
+            logger.info(f"☁️ [秒传] {len(skipped)} 个文件云端已有相同内容，跳过上传")
+            done.extend(skipped)
+        if copies:
+            if copy_remote(api, config, copies, self.rate):
+                for item, src in copies:
+                    done.append(item)
+                    copy_of[item[1]] = src
+            else:
+                uploads.extend(item for item, _ in copies)
+
+        singles = [item for item in uploads if item[1] in digests and is_resumable(config, item[2])]
+        uploads = [item for item in uploads if item not in singles]
+        if uploads and config.get('enable_batch_commit', False):
+            batch_mb = sum(item[2] for item in uploads) / (1024*1024)
+            logger.info(f"▶ [开始] 批量上传: {len(uploads)} 个文件 ({batch_mb:.1f} MB)")
+            with METRICS.timer("hf_uploader_upload_duration_seconds", mode="batch"):
+                uploaded, not_uploaded, api = upload_batch(api, config, uploads, remote_index, digests, self.rate, self.limiter)
+            done.extend(uploaded)
+            failed.extend(not_uploaded)
+        else:
+            singles.extend(uploads)
+
+        for item in singles: # 大文件即使在批量模式下也单独走断点续传
+            if stop_event.is_set(): break
+            local_p, rel_p, size = item
+            logger.info(f"▶ [开始] 上传: {os.path.basename(rel_p)} ({size / (1024*1024):.1f} MB)")
+            mode = "resumable" if rel_p in digests and is_resumable(config, size) else "single"
+            with METRICS.timer("hf_uploader_upload_duration_seconds", mode=mode):
+                ok, api = upload_single(api, config, local_p, rel_p, size, remote_index, digests.get(rel_p), self.store, self.rate, self.limiter)
+            (done if ok else failed).append(item)
+
+        with self.lock:
+            if self.api is start_api: self.api = api # 重试时换过客户端；热更新换过的就不覆盖
+        for local_p, rel_p, size in done:
+            remote_p = build_remote_path(config, rel_p)
+            digest = digests.get(rel_p)
+            self.store.mark_uploaded(rel_p, size, file_mtime(local_p), remote_p, digest[0] if digest else None, copy_of.get(rel_p))
+            remote_index.record(remote_p, size, digest)
+            if rel_p in copy_of: METRICS.inc("hf_uploader_files_total", result="copied")
+            elif (local_p, rel_p, size) in skipped: METRICS.inc("hf_uploader_files_total", result="skipped")
+            else:
+                METRICS.inc("hf_uploader_files_total", result="uploaded")
+                METRICS.inc("hf_uploader_uploaded_bytes_total", size)
+            handle_upload_success(config, local_p, rel_p, size / (1024*1024))
+        if not stop_event.is_set():
+            for local_p, rel_p, size in failed:
+                METRICS.inc("hf_uploader_files_total", result="failed")
+                handle_upload_failure(config, self.store, local_p, rel_p, size)
+        return len(done)
+
+    def _run_pack(self, batch, shard_rel):
+        members, failed = [], []
+        for item in batch:
+            try:
+                st = os.stat(item[0])
+                members.append((item[0], item[1], st.st_size, st.st_mtime))
+            except Exception as e:
+                logger.warning(f"⚠️ [跳过] 本地文件不可读: {os.path.basename(item[1])} ({e})")
+                failed.append(item)
+        if not members: return 0
+        with self.lock: config, api, remote_index = self.config, self.api, self.remote_index
+        start_api = api
+        shard = PackedShard(shard_rel.rsplit('.', 1)[1], members)
+        remote_p = build_remote_path(config, shard_rel)
+        shard_name = os.path.basename(shard_rel)
+        try:
+            logger.info(f"▶ [开始] 上传分片: {shard_name} ({len(members)} 个文件, {shard.size / (1024*1024):.1f} MB)")
+            with METRICS.timer("hf_uploader_upload_duration_seconds", mode="pack"):
+                ok, api = upload_pack(api, config, shard, remote_p, remote_index, self.rate, self.limiter)
+        finally:
+            shard.close()
+        with self.lock:
+            if self.api is start_api: self.api = api
+
+        if not ok:
+            if not stop_event.is_set():
+                for local_p, rel_p, size, _ in members:
+                    METRICS.inc("hf_uploader_files_total", result="failed")
+                    handle_upload_failure(config, self.store, local_p, rel_p, size)
+            return 0
+        self.store.mark_packed([(rel_p, size, mtime) for _, rel_p, size, mtime in members], remote_p)
+        remote_index.record(remote_p, shard.size)
+        METRICS.inc("hf_uploader_files_total", len(members), result="uploaded")
+        METRICS.inc("hf_uploader_uploaded_bytes_total", shard.size)
+        logger.info(f"✅ [成功] 分片 {shard_name} 已上传，包含 {len(members)} 个文件")
+        if shard.size >= safe_int(config.get('notify_min_size'), 1024) * 1024 * 1024:
+            send_email(config, "大文件上传成功", f"分片: {shard_rel} ({len(members)} 个文件)")
+        if config.get('delete_after_upload', True):
+            removed = 0
+            for local_p, _, _, _ in members:
+                try:
+                    os.remove(local_p)
+                    removed += 1
+                except: pass
+            for folder in {os.path.dirname(m[0]) for m in members}: recursive_delete_empty(folder)
+            logger.info(f"🗑️ [删除] 分片 {shard_name} 的 {removed} 个本地文件")
+        return len(members)
+
+    def _job_done(self, folder_name, batch, success):
+        with self.lock:
+            self.inflight.difference_update(item[1] for item in batch)
+            self._update_gauges()
+            tracker = self.folders.get(folder_name)
+            if tracker is None: return
+            tracker['remaining'] -= 1
+            tracker['active'] -= 1
+            tracker['success'] += success
+            if tracker['remaining'] > 0: return
+            del self.folders[folder_name]
+
+        if tracker['success'] > 0:
+            status_text = "本地已清理" if self.config.get('delete_after_upload', True) else "保留"
+            msg = f"目录：{folder_name}<br>成功：{tracker['success']} 个<br>状态：{status_text}"
+            send_email(self.config, "NAS文件夹任务完成", msg)
+            logger.info(f"🎉 [完成] 目录 {folder_name} 处理完毕")
+
+# 🌟 文件扫描：inotify 实时监听，内核不支持时回退到轮询全量扫描
+class FileFilter:
+    """包含/排除规则 (glob)，启动时编译一次。不含 / 的规则匹配文件名，含 / 的规则匹配相对路径 (如 电影/*)"""
+    def __init__(self, include="", exclude="*.json"):
+        self.include = self._compile(include)
+        self.exclude = self._compile(exclude)
+        self.signature = f"{include or ''}\n{exclude or ''}" # 规则变了目录索引就作废
+
+    @staticmethod
+    def _compile(patterns):
+        rules = [p.strip() for p in re.split(r'[,;\n]', patterns or '') if p.strip()]
+        if not rules: return None
+        by_name = [fnmatch.translate(p) for p in rules if '/' not in p]
+        by_path = [fnmatch.translate(p.lstrip('/')) for p in rules if '/' in p]
+        return (re.compile('|'.join(by_name)) if by_name else None,
+                re.compile('|'.join(by_path)) if by_path else None)
+
+    @staticmethod
+    def _match(compiled, name, rel):
+        by_name, by_path = compiled
+        return bool((by_name and by_name.match(name)) or (by_path and by_path.match(rel)))
+
+    def allows(self, name, rel):
+        if name.startswith('.') or name in JUNK_FILES: return False
+        if self.include and not self._match(self.include, name, rel): return False
+        return not (self.exclude and self._match(self.exclude, name, rel))
+
+def create_file_filter(config):
+    return FileFilter(config.get('include_patterns', ''), config.get('exclude_patterns', '*.json'))
+
+def filter_dir_files(root, files, file_filter):
+    """返回目录内可上传的 (绝对路径, 相对路径)。目录里有下载临时文件时整个目录跳过。"""
+    for f in files: # 检查迅雷临时文件
+        if f.endswith(TEMP_SUFFIXES): return []
+    result = []
+    rel_root = os.path.relpath(root, DATA_DIR).replace("\\", "/")
+    for file in files:
+        rel = file if rel_root == '.' else f"{rel_root}/{file}"
+        if file_filter.allows(file, rel): result.append((os.path.join(root, file), rel))
+    return result
+
+class PollingScanner:
+    """按目录 mtime 缓存每个目录的过滤结果并持久化：目录里没有增删改名时只需一次 stat，不再列目录、逐个过滤"""
+    name = "轮询扫描"
+    exhausted = False
+    FRESH_NS = 2 * 10**9 # 刚修改过的目录 mtime 可能还会在同一时间粒度内再变，先不缓存
+
+    def __init__(self, file_filter, store=None):
+        self.filter = file_filter
+        self.store = store
+        self.dirs = {} # 目录 -> (mtime_ns, 文件列表, 子目录列表)
+        if store:
+            for path, mtime_ns, names, subdirs in store.load_dir_index(file_filter.signature):
+                self.dirs[path] = (mtime_ns, filter_dir_files(path, names, file_filter), subdirs)
+
+    def _list(self, path):
+        names, subdirs = [], []
+        with os.scandir(path) as it:
+            for entry in it:
+                try: is_dir = entry.is_dir()
+                except OSError: continue
+                if not is_dir: names.append(entry.name)
+                elif not entry.is_symlink(): subdirs.append(entry.path)
+        names.sort()
+        subdirs.sort()
+        return names, subdirs
+
+    def candidates(self):
+        result, seen, changed = [], set(), []
+        stack = [DATA_DIR]
+        while stack:
+            path = stack.pop()
+            try: mtime_ns = os.stat(path).st_mtime_ns
+            except OSError: continue
+            seen.add(path)
+            cached = self.dirs.get(path)
+            if cached is None or cached[0] != mtime_ns:
+                try: names, subdirs = self._list(path)
+                except OSError: continue
+                if time.time_ns() - mtime_ns < self.FRESH_NS: mtime_ns = None
+                cached = (mtime_ns, filter_dir_files(path, names, self.filter), subdirs)
+                self.dirs[path] = cached
+                changed.append((path, mtime_ns, names, subdirs))
+            result.extend(cached[1])
+            stack.extend(reversed(cached[2]))
+        removed = [p for p in self.dirs if p not in seen]
+        for p in removed: del self.dirs[p]
+        if self.store and (changed or removed):
+            try: self.store.save_dir_index(self.filter.signature, changed, removed)
+            except Exception as e: logger.warning(f"⚠️ [索引] 目录索引保存失败: {e}")
+        return result
+
+    def close(self): pass
+
+class InotifyScanner:
+    """在内存里维护每个目录的文件列表，只在收到事件时更新对应目录，不再反复遍历整棵树"""
+    name = "inotify 实时监听"
+    IN_MODIFY, IN_CLOSE_WRITE = 0x2, 0x8
+    IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+    IN_DELETE_SELF, IN_MOVE_SELF = 0x400, 0x800
+    IN_Q_OVERFLOW, IN_IGNORED, IN_ISDIR = 0x4000, 0x8000, 0x40000000
+    ENOSPC = 28 # 监听数达到上限
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, root, file_filter):
+        self.root = root
+        self.filter = file_filter
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0: raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self.wd_to_dir = {}
+        self.dir_to_wd = {}
+        self.dir_files = {} # 目录 -> 文件名集合
+        self.pending = {}   # 目录 -> 过滤后的待传列表
+        self.exhausted = False # 运行中监听数耗尽，新目录已无法监听，需要换成轮询
+        try: self._add_tree(root)
+        except:
+            self.close()
+            raise
+
+    def _add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if path == self.root or err == self.ENOSPC: raise OSError(err, f"inotify_add_watch 失败: {path}")
+            return
+        self.wd_to_dir[wd] = path
+        self.dir_to_wd[path] = wd
+
+    def _add_tree(self, top):
+        # 先挂监听再列目录，挂监听前已写入的文件也能被收录
+        for root, dirs, files in os.walk(top):
+            self._add_watch(root)
+            self.dir_files[root] = set(files)
+            self._refresh(root)
+
+    def _remove_tree(self, top):
+        prefix = top + os.sep
+        for path in [p for p in self.dir_to_wd if p == top or p.startswith(prefix)]:
+            wd = self.dir_to_wd.pop(path)
+            self.wd_to_dir.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+            self.dir_files.pop(path, None)
+            self.pending.pop(path, None)
+
+    def _refresh(self, path):
+        files = self.dir_files.get(path)
+        if files: self.pending[path] = filter_dir_files(path, sorted(files), self.filter)
+        else: self.pending.pop(path, None)
+
+    def _drain(self):
+        dirty = set()
+        while True:
+            try: buf = os.read(self.fd, 65536)
+            except BlockingIOError: break
+            if not buf: break
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _, length = self.EVENT_HEADER.unpack_from(buf, offset)
+                offset += self.EVENT_HEADER.size
+                name = os.fsdecode(buf[offset:offset + length].rstrip(b'\0'))
+                offset += length
+
+                if mask & self.IN_Q_OVERFLOW:
+                    logger.warning("⚠️ [监听] 事件队列溢出，重新建立索引...")
+                    self._remove_tree(self.root)
+                    self._add_tree_safe(self.root)
+                    continue
+                parent = self.wd_to_dir.get(wd)
+                if parent is None: continue
+                if mask & (self.IN_IGNORED | self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                    if parent != self.root: self._remove_tree(parent)
+                    continue
+
+                path = os.path.join(parent, name)
+                if mask & self.IN_ISDIR:
+                    if mask & (self.IN_CREATE | self.IN_MOVED_TO): self._add_tree_safe(path)
+                    elif mask & (self.IN_DELETE | self.IN_MOVED_FROM): self._remove_tree(path)
+                    continue
+
+                files = self.dir_files.setdefault(parent, set())
+                if mask & (self.IN_DELETE | self.IN_MOVED_FROM): files.discard(name)
+                else: files.add(name)
+                dirty.add(parent)
+        for path in dirty: self._refresh(path)
+
+    def _add_tree_safe(self, top):
+        # 监听数耗尽时不能从 _drain 里抛出去，否则缓冲区里剩下的事件和已标记的目录都会丢；先记下来，处理完这批事件再由调用方换成轮询
+        try: self._add_tree(top)
+        except OSError as e:
+            if e.errno != self.ENOSPC: raise
+            if not self.exhausted: logger.warning(f"⚠️ [监听] inotify 监听数已达上限 ({top})，稍后改用轮询扫描")
+            self.exhausted = True
+
+    def candidates(self):
+        self._drain()
+        return [item for items in self.pending.values() for item in items]
+
+    def close(self):
+        if self.fd >= 0:
+            try: os.close(self.fd)
+            except: pass
+            self.fd = -1
+
+def create_scanner(config, store=None):
+    file_filter = create_file_filter(config)
+    if config.get('watch_mode', 'auto') != 'poll':
+        try:
+            scanner = InotifyScanner(DATA_DIR, file_filter)
+            logger.info(f"👀 [监听] 已启用 {scanner.name} ({len(scanner.dir_to_wd)} 个目录)")
+            return scanner
+        except Exception as e:
+            logger.warning(f"⚠️ [监听] inotify 不可用 ({e})，改用轮询扫描")
+    return PollingScanner(file_filter, store)
+
+# 🌟 V40 核心：文件夹稳定性校验 (增量版：跨扫描周期保存快照，不再阻塞等待)
+class StabilityTracker:
+    """记录每个文件夹待传文件的 (大小, 修改时间) 快照，快照连续 duration 秒不变即视为写入完成。
+    只 stat 本轮的待传文件，不遍历目录；新出现的文件会进下一轮的待传列表，同样算作变化。"""
+    def __init__(self):
+        self.snapshots = {} # 文件夹 -> (快照, 最近一次变化的时间, 首次发现的时间)
+
+    def _snapshot(self, files):
+        snapshot = {}
+        for p in files:
+            try: st = os.stat(p)
+            except FileNotFoundError: continue
+            snapshot[p] = (st.st_size, st.st_mtime)
+        return snapshot
+
+    def is_stable(self, folder_path, files, duration):
+        now = time.time()
+        try:
+            with METRICS.timer("hf_uploader_stability_check_seconds"): snapshot = self._snapshot(files)
+        except: return False
+
+        previous = self.snapshots.get(folder_path)
+        if previous is None:
+            self.snapshots[folder_path] = (snapshot, now, now)
+            if duration > 0:
+                logger.info(f"🛡️ [校验] 开始检查 '{os.path.basename(folder_path)}'，静止 {duration}秒后上传...")
+            stable = duration <= 0
+        else:
+            old_snapshot, since, first_seen = previous
+            if snapshot != old_snapshot:
+                changed = next((p for p, meta in snapshot.items() if old_snapshot.get(p) != meta), None)
+                logger.info(f"⏳ [写入中] 文件变化: {os.path.basename(changed) if changed else os.path.basename(folder_path)}")
+                self.snapshots[folder_path] = (snapshot, now, first_seen)
+                stable = duration <= 0
+            else:
+                stable = now - since >= duration
+        if stable: METRICS.observe("hf_uploader_stability_wait_seconds", now - self.snapshots[folder_path][2])
+        return stable
+
+    def status(self, folder_path, files):
+        """给状态面板用：返回 (这些文件的总大小, 最近一次变化的时间, 首次发现的时间)，大小优先取快照里的"""
+        snapshot, since, first_seen = self.snapshots.get(folder_path, ({}, None, None))
+        total = 0
+        for p in files:
+            meta = snapshot.get(p)
+            if meta is None:
+                try: meta = (os.path.getsize(p),)
+                except: continue
+            total += meta[0]
+        return total, since, first_seen
+
+    def forget(self, folder_path):
+        self.snapshots.pop(folder_path, None)
+
+    def prune(self, active_folders):
+        for p in [p for p in self.snapshots if p not in active_folders]: del self.snapshots[p]
+
+# 🌟 多目标路由：按路径规则把不同子目录上传到不同的仓库 / 镜像站，共用一次扫描和一个状态库
+class TargetRouter:
+    """settings.json 里的 targets 按顺序匹配 (规则写法同“只上传/排除”)，第一条命中的生效；都不命中时走主配置"""
+    DEFAULT = "默认"
+    TARGET_KEYS = ('repo_id', 'repo_type', 'remote_folder', 'hf_endpoint', 'hf_token', 'upload_workers',
+                   'max_commits_per_min', 'enable_batch_commit', 'batch_max_files', 'batch_max_mb', 'resumable_min_mb',
+                   'pack_mode', 'pack_min_files', 'pack_shard_mb')
+
+    def __init__(self, config):
+        self.configs = {} # 目标名 -> 合并后的配置
+        self.rules = []   # (目标名, 编译后的规则)
+        if config.get('repo_id'): self.configs[self.DEFAULT] = config
+        for i, target in enumerate(config.get('targets') or []):
+            name = str(target.get('name') or f"目标{i+1}")
+            paths = target.get('paths', '')
+            rule = FileFilter._compile(",".join(paths) if isinstance(paths, list) else paths)
+            if rule is None or not target.get('repo_id') or name in self.configs:
+                logger.warning(f"⚠️ [路由] 目标 {name} 缺少 paths / repo_id 或重名，已忽略")
+                continue
+            self.configs[name] = dict(config, **{k: v for k, v in target.items() if k in self.TARGET_KEYS})
+            self.rules.append((name, rule))
+
+    def route(self, rel):
+        """返回文件所属的目标名，没有匹配的目标时返回 None"""
+        name = os.path.basename(rel)
+        for target, rule in self.rules:
+            if FileFilter._match(rule, name, rel): return target
+        return self.DEFAULT if self.DEFAULT in self.configs else None
+
+def validate_targets(targets):
+    """/save 时校验路由表，返回 (列表, 错误信息)"""
+    if isinstance(targets, str):
+        targets = targets.strip()
+        if not targets: return [], None
+        try: targets = json.loads(targets)
+        except Exception as e: return None, f"多目标路由不是合法 JSON: {e}"
+    if not targets: return [], None
+    if not isinstance(targets, list) or not all(isinstance(t, dict) for t in targets):
+        return None, "多目标路由必须是对象列表"
+    for i, target in enumerate(targets):
+        if not target.get('paths') or not target.get('repo_id'):
+            return None, f"多目标路由第 {i+1} 项缺少 paths 或 repo_id"
+    return targets, None
+
+# 🌟 配置热更新：/save 发布新版本，守护线程在两轮扫描之间应用，上传线程在两个任务之间读取
+class LiveConfig:
+    """带版本号的当前配置，版本号只增不减，守护线程靠它判断有没有新配置"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0
+        self.config = None
+
+    def publish(self, config):
+        with self.lock:
+            self.version += 1
+            self.config = config
+            return self.version
+
+    def newer_than(self, version):
+        """有新版本时返回 (版本号, 配置)，否则返回 None"""
+        with self.lock:
+            return (self.version, self.config) if self.version > version else None
+
+LIVE_CONFIG = LiveConfig()
+INDEX_KEYS = ('repo_id', 'repo_type', 'remote_folder', 'remote_cache_ttl') # 变了才重建云端索引
+SCANNER_KEYS = ('watch_mode', 'include_patterns', 'exclude_patterns')      # 变了才重建扫描器
+
+def client_key(config):
+    return (config.get('hf_endpoint', 'https://hf-mirror.com'), config['hf_token'])
+
+def set_hub_env(config):
+    os.environ["HF_ENDPOINT"] = config.get('hf_endpoint', 'https://hf-mirror.com')
+    if config.get('enable_hf_transfer', False):
         os.environ["HF_HUB_ENABLE_HF_TRANSFER"] = "1"
     else:
         if "HF_HUB_ENABLE_HF_TRANSFER" in os.environ: del os.environ["HF_HUB_ENABLE_HF_TRANSFER"]
+
+def login_clients(router, clients):
+    """clients: (地址, Token) -> HfApi，多个目标用同一账号时共用一个客户端，只登录一次。返回登录成功的目标 {名字: 配置}"""
+    for name, target_cfg in router.configs.items():
+        key = client_key(target_cfg)
+        if key in clients: continue
+        try:
+            api = HfApi(token=key[1], endpoint=key[0])
+            user = api.whoami()
+            clients[key] = api
+            logger.info(f"✅ 登录成功: {user['name']}" + (f" ({key[0]})" if len(router.configs) > 1 else ""))
+        except Exception as e:
+            logger.error(f"❌ 登录失败{'' if name == router.DEFAULT else f' [{name}]'}: {str(e)}")
+    return {name: cfg for name, cfg in router.configs.items() if client_key(cfg) in clients}
+
+def create_remote_index(config):
+    remote_root = (config.get('remote_folder') or '').strip().strip('/')
+    return RemoteIndex(config['repo_id'], config['repo_type'], remote_root if remote_root not in ('', '.') else None,
+                       safe_int(config.get('remote_cache_ttl'), 600))
+
+def apply_config(config, clients, pools, store, limiter):
+    """应用新配置并返回新的路由。只重建受影响的部分：Token / 地址变了才重新登录，仓库变了才换云端索引；
+    上传中的任务用旧配置传完，哈希缓存、目录索引和稳定性快照都保留。"""
+    router = TargetRouter(config)
+    targets = login_clients(router, clients)
+    for name, target_cfg in targets.items():
+        api = clients[client_key(target_cfg)]
+        pool = pools.get(name)
+        if pool is None:
+            pools[name] = UploadPool(api, target_cfg, store, create_remote_index(target_cfg), name, limiter, router)
+            pools[name].start()
+            logger.info(f"🔀 [热更新] 新增上传目标: {name} → {target_cfg['repo_id']}")
+            continue
+        same_repo = all(pool.config.get(k) == target_cfg.get(k) for k in INDEX_KEYS)
+        with pool.lock: pool.retired = False
+        pool.configure(api, target_cfg, pool.remote_index if same_repo else create_remote_index(target_cfg), router)
+    for name, pool in pools.items():
+        if name in targets: continue
+        if name in router.configs:
+            logger.warning(f"⚠️ [热更新] {name}: 新账号登录失败，继续使用旧配置")
+            with pool.lock: pool.router = router
+        elif not pool.retired:
+            pool.retire()
+            logger.info(f"🔀 [热更新] 上传目标 {name} 已删除，队列传完后停止")
+    limiter.rate = max(0, safe_int(config.get('max_upload_mbps'), 0)) * 1024 * 1024
+    in_use = {client_key(p.config) for p in pools.values()}
+    for key in [k for k in clients if k not in in_use]: del clients[key]
+    return router
+
+def uploader_daemon(config, version=0):
+    global is_running
+    mode_str = "🚀 高速模式" if config.get('enable_hf_transfer', False) else "🐢 稳定模式"
     
+    logger.info(f"🚀 服务启动 | 目标: {config.get('hf_endpoint', 'https://hf-mirror.com')} | {mode_str}")
+    set_hub_env(config)
+    
+    router = TargetRouter(config)
+    clients = {}
+    targets = login_clients(router, clients)
+    if not targets:
+        is_running = False
+        return
+
     try:
-        api = HfApi(token=config['hf_token'], endpoint=endpoint)
-        user = api.whoami()
-        logger.info(f"✅ 登录成功: {user['name']}")
+        store = StateStore(STATE_DB_FILE)
+        store.migrate_json(os.path.join(os.path.dirname(CONFIG_FILE), "history.json"), FAILURE_RECORD_FILE)
     except Exception as e:
-        logger.error(f"❌ 登录失败: {str(e)}")
+        logger.error(f"❌ 状态库打开失败: {str(e)}")
         is_running = False
         return
 
-    history_file = os.path.join(os.path.dirname(CONFIG_FILE), "history.json")
-    uploaded_files = set()
-    if os.path.exists(history_file):
-        try:
-            with open(history_file, 'r') as f: uploaded_files = set(json.load(f))
-        except: pass
+    limiter = BandwidthLimiter(max(0, safe_int(config.get('max_upload_mbps'), 0)) * 1024 * 1024) # 总限速所有目标共用
+    pools = {}
+    for name, target_cfg in targets.items():
+        pools[name] = UploadPool(clients[client_key(target_cfg)], target_cfg, store, create_remote_index(target_cfg), name, limiter, router)
+        pools[name].start()
+    STATUS.attach(store, pools)
+    if router.rules:
+        logger.info(f"🔀 [路由] {len(pools)} 个上传目标: " + ", ".join(f"{n} → {p.config['repo_id']}" for n, p in pools.items()))
+    scanner = create_scanner(config, store)
+    stability = StabilityTracker()
 
     last_busy = time.time()
     last_idle = 0
+    last_pending = 0
     is_idle_mode = False
 
     while not stop_event.is_set():
         try:
+            update = LIVE_CONFIG.newer_than(version)
+            if update:
+                version, new_config = update
+                changed = sorted(k for k in set(config) | set(new_config) if config.get(k) != new_config.get(k))
+                if changed:
+                    set_hub_env(new_config)
+                    router = apply_config(new_config, clients, pools, store, limiter)
+                    if any(config.get(k) != new_config.get(k) for k in SCANNER_KEYS):
+                        scanner.close()
+                        scanner = create_scanner(new_config, store)
+                    config = new_config
+                    logger.info(f"🔄 [热更新] 第 {version} 版配置已生效: {', '.join(changed)}")
+            for name in [n for n, p in pools.items() if p.retired and not p.alive()]: del pools[name]
+
             # 🌟 0. 实时扫描反馈
             logger.debug(f"🔍 正在扫描新文件...")
             
             all_files = []
             
             # 1. 扫描与残留补漏
-            for root, dirs, files in os.walk(DATA_DIR):
-                has_temp_file = False
-                for f in files: # 检查迅雷临时文件
-                    if f.endswith(('.xltd', '.tmp', '.download')): has_temp_file = True; break
-                if has_temp_file: continue
+            leftovers = []
+            with METRICS.timer("hf_uploader_scan_duration_seconds", backend=type(scanner).__name__):
+                candidates = list(scanner.candidates())
+            if scanner.exhausted: # 运行中 inotify 监听数耗尽，新目录监听不到，换成轮询重新全量扫一遍
+                scanner.close()
+                scanner = PollingScanner(create_file_filter(config), store)
+                logger.info(f"👀 [监听] 已切换为 {scanner.name}")
+                with METRICS.timer("hf_uploader_scan_duration_seconds", backend=type(scanner).__name__):
+                    candidates = list(scanner.candidates())
+            METRICS.inc("hf_uploader_files_scanned_total", len(candidates))
+            for full, rel in candidates:
+                pool = pools.get(router.route(rel))
+                if pool is None: continue # 没有匹配的上传目标
+                if pool.is_inflight(rel): continue # 已在上传队列中
                 
-                for file in files:
-                    if file.startswith('.') or file.endswith('.json'): continue
-                    if file in JUNK_FILES: continue
-                    
-                    full = os.path.join(root, file)
-                    rel = os.path.relpath(full, DATA_DIR).replace("\\", "/")
-                    
-                    # 🌟 V43 核心改进：即使在历史记录里，如果本地文件还在，也得处理！
-                    if rel in uploaded_files:
-                        # 检查是否真的上传了
-                        remote_f = config.get('remote_folder', '')
-                        if not remote_f or remote_f.strip() == "": remote_f = "."
-                        remote_p = f"{remote_f}/{rel}" if remote_f != "." else rel
-                        
-                        # 只有当开启了自动删除，且文件滞留在本地时，才进行“补刀”检查
-                        if config.get('delete_after_upload', True):
-                            logger.info(f"🧐 [补漏] 发现残留文件: {file}，正在核实云端...")
-                            if check_remote_success(api, config['repo_id'], config['repo_type'], remote_p, os.path.getsize(full)):
-                                logger.info(f"🗑️ [补刀] 云端已存在，执行删除: {file}")
-                                try:
-                                    os.remove(full)
-                                    recursive_delete_empty(os.path.dirname(full))
-                                except: pass
-                                continue # 删完了就跳过上传
-                            else:
-                                logger.info(f"⚠️ [重传] 云端缺失，重新加入队列: {file}")
-                                # 从历史记录移除，以便重新上传
-                                uploaded_files.discard(rel)
-                    
-                    # 加入待传列表
-                    all_files.append((full, rel))
+                # 🌟 V43 核心改进：即使在历史记录里，如果本地文件还在，也得处理！
+                # 只有当开启了自动删除，且文件滞留在本地时，才进行“补刀”检查；未开启自动删除则保留本地文件，不重复上传
+                if store.is_uploaded(rel):
+                    try: st = os.stat(full)
+                    except OSError: continue
+                    if store.is_uploaded(rel, st.st_size, st.st_mtime):
+                        if config.get('delete_after_upload', True): leftovers.append((full, rel, pool))
+                        continue
+                    logger.info(f"✏️ [改动] 上传后本地文件有变化，重新加入队列: {os.path.basename(rel)}")
+                    store.mark_pending(rel)
+                
+                # 加入待传列表
+                all_files.append((full, rel))
+
+            if leftovers:
+                unpacked = []
+                for full, rel, pool in leftovers:
+                    try: st = os.stat(full)
+                    except: continue
+                    shard = store.packed_in(rel, st.st_size, st.st_mtime)
+                    if shard is None:
+                        unpacked.append((full, rel, pool))
+                        continue
+                    # 分片和 manifest 是同一个 commit 提交的，记录在案且本地没改动就说明已在云端
+                    logger.info(f"🗑️ [补刀] 已打包在 {os.path.basename(shard)}，执行删除: {os.path.basename(rel)}")
+                    try:
+                        os.remove(full)
+                        recursive_delete_empty(os.path.dirname(full))
+                    except: pass
+                leftovers = unpacked
+
+            if leftovers:
+                logger.info(f"🧐 [补漏] 发现 {len(leftovers)} 个残留文件，正在批量核实云端...")
+                by_pool = {}
+                for _, rel, pool in leftovers: by_pool.setdefault(pool, []).append(build_remote_path(pool.config, rel))
+                for pool, remote_paths in by_pool.items(): pool.remote_index.prefetch(pool.api, remote_paths)
+                unknown = 0
+                for full, rel, pool in leftovers:
+                    file = os.path.basename(rel)
+                    # 扫描线程里不读整个文件：只用缓存里的哈希，没有缓存的只比大小
+                    digest = pool.hasher.cached(full) if config.get('enable_dedup', True) else None
+                    found = pool.remote_index.matches(pool.api, build_remote_path(pool.config, rel), os.path.getsize(full), digest)
+                    if found is None: # 云端查询失败：保留已上传记录，下一轮再核实，不把残留文件全部重传
+                        unknown += 1
+                    elif found:
+                        logger.info(f"🗑️ [补刀] 云端已存在，执行删除: {file}")
+                        try:
+                            os.remove(full)
+                            recursive_delete_empty(os.path.dirname(full))
+                        except: pass
+                    else:
+                        logger.info(f"⚠️ [重传] 云端缺失，重新加入队列: {file}")
+                        # 从历史记录移除，以便重新上传
+                        store.mark_pending(rel)
+                        all_files.append((full, rel))
+                if unknown: logger.info(f"⏸️ [补漏] {unknown} 个残留文件暂时查不到云端状态，下一轮再核实")
 
             if all_files:
                 is_idle_mode = False
@@ -274,107 +2309,53 @@ def uploader_daemon(config):
                     if folder not in tasks_by_folder: tasks_by_folder[folder] = []
                     tasks_by_folder[folder].append((full, rel))
 
-                logger.info(f"📦 发现 {len(all_files)} 个待处理文件")
-                failures_db = load_failures()
+                if len(all_files) != last_pending: # 数量没变就不重复刷屏
+                    logger.info(f"📦 发现 {len(all_files)} 个待处理文件")
+                    last_pending = len(all_files)
 
+                waiting, ready = [], []
                 for folder_name, tasks in tasks_by_folder.items():
                     if stop_event.is_set(): break
-                    
-                    # 文件夹原子锁校验
                     folder_abs_path = os.path.dirname(tasks[0][0])
                     stability_time = safe_int(config.get('stability_duration'), 30) # V43 默认30秒
+                    if any(p.folder_busy(folder_name) for p in pools.values()): # 上一轮的任务还没传完，新文件下一轮再排队
+                        waiting.append((folder_name, tasks, "busy"))
+                        continue
                     
-                    if not check_folder_stability(folder_abs_path, stability_time):
-                        logger.info(f"⏳ [等待] 文件夹 '{folder_name}' 正在写入，跳过...")
-                        continue 
-
-                    logger.info(f"🔒 [锁定] 文件夹 '{folder_name}' 校验通过，开始上传...")
-                    folder_success_count = 0
-                    tasks.sort(key=lambda x: x[1])
-
-                    for i, (local_p, rel_p) in enumerate(tasks):
-                        if stop_event.is_set(): break
-                        
-                        file_name = os.path.basename(rel_p)
-                        if i > 0: time.sleep(safe_int(config.get('file_interval'), 15))
-
-                        remote_f = config.get('remote_folder', '')
-                        if not remote_f or remote_f.strip() == "": remote_f = "."
-                        remote_p = f"{remote_f}/{rel_p}" if remote_f != "." else rel_p
-                        size_mb = os.path.getsize(local_p) / (1024*1024)
-
-                        logger.info(f"▶ [开始] 上传: {file_name} ({size_mb:.1f} MB)")
-
-                        success = False
-                        max_retries = safe_int(config.get('max_retries'), 5)
-                        
-                        for attempt in range(max_retries):
-                            if stop_event.is_set(): break
-                            try:
-                                api.upload_file(
-                                    path_or_fileobj=local_p, 
-                                    path_in_repo=remote_p,
-                                    repo_id=config['repo_id'],
-                                    repo_type=config['repo_type'],
-                                    token=config['hf_token']
-                                )
-                                success = True
-                                break
-                            except Exception as e:
-                                err_str = str(e)
-                                logger.info(f"⚠️ 校验远程状态...")
-                                if check_remote_success(api, config['repo_id'], config['repo_type'], remote_p, os.path.getsize(local_p)):
-                                    logger.info(f"🎉 [捡漏] 远程文件已存在，视为成功！")
-                                    success = True
-                                    break
-                                
-                                backoff = 30 * (2 ** attempt)
-                                logger.warning(f"❌ [重试] 第{attempt+1}次失败，休息 {backoff}秒...")
-                                time.sleep(backoff)
-                                if "401" in err_str: 
-                                    try: api = HfApi(token=config['hf_token'], endpoint=endpoint)
-                                    except: pass
-
-                        if success:
-                            logger.info(f"✅ [成功] 任务完成: {file_name}")
-                            uploaded_files.add(rel_p)
-                            with open(history_file, 'w') as f: json.dump(list(uploaded_files), f)
-                            
-                            if rel_p in failures_db:
-                                del failures_db[rel_p]
-                                save_failures(failures_db)
-
-                            folder_success_count += 1
-                            
-                            if size_mb >= safe_int(config.get('notify_min_size'), 1024):
-                                send_email(config, "大文件上传成功", f"文件: {rel_p}")
-
-                            if config.get('delete_after_upload', True):
-                                try:
-                                    os.remove(local_p)
-                                    logger.info(f"🗑️ [删除] 本地文件: {file_name}")
-                                    recursive_delete_empty(os.path.dirname(local_p))
-                                except: pass
-                        else:
-                            logger.error(f"⛔ [失败] 放弃上传: {file_name}")
-                            current_time = time.time()
-                            if rel_p not in failures_db:
-                                failures_db[rel_p] = current_time
-                                save_failures(failures_db)
-                            else:
-                                if (current_time - failures_db[rel_p]) > 86400:
-                                    send_email(config, "严重：文件失败超24小时", f"文件: {rel_p}")
-                                    failures_db[rel_p] = current_time
-                                    save_failures(failures_db)
-
-                    if folder_success_count > 0:
-                        status_text = "本地已清理" if config.get('delete_after_upload', True) else "保留"
-                        msg = f"目录：{folder_name}<br>成功：{folder_success_count} 个<br>状态：{status_text}"
-                        send_email(config, "NAS文件夹任务完成", msg)
-                        logger.info(f"🎉 [完成] 目录 {folder_name} 处理完毕")
+                    # 文件夹原子锁校验
+                    if not stability.is_stable(folder_abs_path, [t[0] for t in tasks], stability_time): # 还在写入，下一轮再看
+                        waiting.append((folder_name, tasks, "writing"))
+                        continue
+
+                    logger.info(f"🔒 [锁定] 文件夹 '{folder_name}' 校验通过，加入上传队列...")
+                    stability.forget(folder_abs_path)
+                    by_target = {}
+                    for task in tasks: by_target.setdefault(router.route(task[1]), []).append(task)
+                    ready.extend((pools[name], folder_name, target_tasks) for name, target_tasks in by_target.items())
 
+                if config.get('enable_dedup', True): # 本轮所有通过校验的文件按目标一次查完云端状态，上传线程核对时直接读缓存
+                    by_pool = {}
+                    for pool, _, target_tasks in ready: by_pool.setdefault(pool, []).extend(build_remote_path(pool.config, t[1]) for t in target_tasks)
+                    for pool, remote_paths in by_pool.items(): pool.remote_index.prefetch(pool.api, remote_paths)
+                for pool, folder_name, target_tasks in ready: pool.submit_folder(folder_name, target_tasks)
+
+                stability.prune({os.path.dirname(tasks[0][0]) for tasks in tasks_by_folder.values()})
+                board = []
+                for folder_name, tasks, state in waiting:
+                    size, since, first_seen = stability.status(os.path.dirname(tasks[0][0]), [t[0] for t in tasks])
+                    board.append({"folder": folder_name, "target": router.route(tasks[0][1]), "state": state, "files": len(tasks), "bytes": size,
+                                  "since": since, "first_seen": first_seen,
+                                  "stable_in": max(0, round(since + stability_time - time.time())) if since else None})
+                STATUS.set_waiting(board)
+                last_busy = time.time()
+            elif any(p.busy() for p in pools.values()):
+                STATUS.set_waiting([])
+                stability.prune(set())
                 last_busy = time.time()
             else:
+                STATUS.set_waiting([])
+                stability.prune(set())
+                last_pending = 0
                 if not is_idle_mode:
                     logger.info("💤 任务已完成，请继续添加文件...")
                     is_idle_mode = True
@@ -393,6 +2374,10 @@ def uploader_daemon(config):
         except Exception as e:
             logger.error(f"⚠️ 系统错误: {e}")
             time.sleep(10)
+    scanner.close()
+    for pool in pools.values(): pool.join()
+    STATUS.attach(None)
+    store.close()
     is_running = False
     logger.info("🛑 进程已停止")
 
@@ -406,11 +2391,13 @@ def help_page():
 
 @app.route('/save', methods=['POST'])
 def save_settings():
-    if is_running: return jsonify({"status": "error", "msg": "🚫 请先【停止服务】再保存！"})
     try:
         cfg = request.json
         if not cfg.get('hf_token'): return jsonify({"status": "error", "msg": "❌ Token 为空"})
-        if not cfg.get('repo_id'): return jsonify({"status": "error", "msg": "❌ 仓库ID 为空"})
+        targets, error = validate_targets(cfg.get('targets'))
+        if error: return jsonify({"status": "error", "msg": f"❌ {error}"})
+        cfg['targets'] = targets
+        if not cfg.get('repo_id') and not targets: return jsonify({"status": "error", "msg": "❌ 仓库ID 为空"})
 
         cfg['email_port'] = safe_int(cfg.get('email_port'), 465)
         cfg['warn_timeout'] = safe_int(cfg.get('warn_timeout'), 900)
@@ -418,13 +2405,28 @@ def save_settings():
         cfg['idle_interval'] = safe_int(cfg.get('idle_interval'), 1800)
         cfg['max_retries'] = safe_int(cfg.get('max_retries'), 3)
         cfg['notify_min_size'] = safe_int(cfg.get('notify_min_size'), 1024)
-        cfg['file_interval'] = safe_int(cfg.get('file_interval'), 15)
+        cfg['max_commits_per_min'] = max(1, safe_int(cfg.get('max_commits_per_min'), 10))
         cfg['stability_duration'] = safe_int(cfg.get('stability_duration'), 30)
+        cfg['batch_max_files'] = safe_int(cfg.get('batch_max_files'), 50)
+        cfg['batch_max_mb'] = safe_int(cfg.get('batch_max_mb'), 1024)
+        cfg['upload_workers'] = max(1, safe_int(cfg.get('upload_workers'), 1))
+        cfg['max_upload_mbps'] = max(0, safe_int(cfg.get('max_upload_mbps'), 0))
+        if cfg.get('watch_mode') not in ('auto', 'poll'): cfg['watch_mode'] = 'auto'
+        cfg['remote_cache_ttl'] = max(0, safe_int(cfg.get('remote_cache_ttl'), 600))
+        cfg['resumable_min_mb'] = max(0, safe_int(cfg.get('resumable_min_mb'), 1024))
+        cfg['email_digest_window'] = max(0, safe_int(cfg.get('email_digest_window'), 60))
+        cfg['include_patterns'] = str(cfg.get('include_patterns') or '').strip()
+        cfg['exclude_patterns'] = str(cfg.get('exclude_patterns') or '').strip()
+        if cfg.get('pack_mode') not in ('off', 'tar', 'zip'): cfg['pack_mode'] = 'off'
+        cfg['pack_min_files'] = max(2, safe_int(cfg.get('pack_min_files'), 1000))
+        cfg['pack_shard_mb'] = max(1, safe_int(cfg.get('pack_shard_mb'), 512))
         
         cfg['hf_token'] = str(cfg['hf_token']).strip()
 
-        if save_config(cfg): return jsonify({"status": "success", "msg": "✅ 保存成功"})
-        else: return jsonify({"status": "error", "msg": "❌ 写入失败"})
+        if not save_config(cfg): return jsonify({"status": "error", "msg": "❌ 写入失败"})
+        LIVE_CONFIG.publish(load_config())
+        if is_running: return jsonify({"status": "success", "msg": "✅ 保存成功，运行中的服务将在当前文件传完后使用新配置"})
+        return jsonify({"status": "success", "msg": "✅ 保存成功"})
     except Exception as e: return jsonify({"status": "error", "msg": f"❌ 错误: {str(e)}"})
 
 @app.route('/reset', methods=['POST'])
@@ -433,6 +2435,11 @@ def reset_settings():
     try:
         if os.path.exists(CONFIG_FILE): os.remove(CONFIG_FILE)
         if os.path.exists(FAILURE_RECORD_FILE): os.remove(FAILURE_RECORD_FILE)
+        STATUS.attach(None)
+        if os.path.exists(STATE_DB_FILE):
+            store = StateStore(STATE_DB_FILE)
+            store.clear_failures()
+            store.close()
         return jsonify({"status": "success", "msg": "🗑️ 配置已清空"})
     except Exception as e: return jsonify({"status": "error", "msg": f"❌ 错误: {str(e)}"})
 
@@ -441,8 +2448,9 @@ def start_worker():
     global uploader_thread, is_running, stop_event
     if is_running: return jsonify({"status": "warning", "msg": "⚠️ 已在运行"})
     cfg = load_config()
+    version = LIVE_CONFIG.publish(cfg)
     stop_event.clear()
-    uploader_thread = threading.Thread(target=uploader_daemon, args=(cfg,))
+    uploader_thread = threading.Thread(target=uploader_daemon, args=(cfg, version))
     uploader_thread.daemon = True
     uploader_thread.start()
     is_running = True
@@ -454,16 +2462,55 @@ def stop_worker():
     stop_event.set()
     return jsonify({"status": "success", "msg": "🛑 正在停止..."})
 
+@app.route('/metrics')
+def metrics():
+    METRICS.set("hf_uploader_running", 1 if is_running else 0)
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/queue')
+def api_queue():
+    return jsonify(STATUS.queue())
+
+@app.route('/api/transfers')
+def api_transfers():
+    return jsonify(STATUS.active())
+
+@app.route('/api/history')
+def api_history():
+    status = request.args.get('status') or None
+    if status not in (None, 'uploaded', 'failed', 'pending'): status = None
+    before = None # 翻页游标：上一页最后一条的 updated_at 和 path
+    try:
+        if request.args.get('before'): before = (float(request.args['before']), request.args.get('before_path', ''))
+    except ValueError: pass
+    limit = min(500, max(1, safe_int(request.args.get('limit'), 50)))
+    store = STATUS.history_store()
+    if store is None: return jsonify({"items": [], "has_more": False, "next": None, "counts": {}})
+    items, has_more = store.history(status, request.args.get('q', '').strip(), before, limit)
+    with store.lock: counts = {k: v for k, v in store.counts.items() if v}
+    cursor = {"before": items[-1]['updated_at'], "before_path": items[-1]['path']} if has_more else None
+    return jsonify({"items": items, "has_more": has_more, "next": cursor, "counts": counts})
+
 @app.route('/logs')
 def stream_logs():
-    def generate():
+    # 浏览器断线重连时会自动带上 Last-Event-ID，从断点继续；新连接先补发缓冲区里的最近日志
+    last_seq = safe_int(request.headers.get('Last-Event-ID') or request.args.get('since'), 0)
+
+    def generate(last_seq):
+        yield "retry: 3000\n\n"
         while True:
-            if not LOG_QUEUE.empty():
-                yield f"data: {LOG_QUEUE.get()}\n\n"
-            else:
-                time.sleep(0.5)
-                yield f"data: \n\n"
-    return Response(generate(), mimetype='text/event-stream')
+            items = LOG_BROADCASTER.read_after(last_seq, 30)
+            if not items:
+                yield ": ping\n\n" # 空闲时 30 秒一次心跳，用于发现已断开的连接
+                continue
+            chunk = []
+            for seq, msg in items:
+                data = "\n".join(f"data: {line}" for line in msg.split("\n"))
+                chunk.append(f"id: {seq}\n{data}\n\n")
+            last_seq = items[-1][0]
+            yield "".join(chunk)
+    return Response(generate(last_seq), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 if __name__ == '__main__':
     os.makedirs("/app/config", exist_ok=True)
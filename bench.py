@@ -0,0 +1,463 @@
+"""
+离线性能基准：本地模拟 Hub + 合成目录树，测量上传吞吐和扫描开销，不需要真实 Token 和网络。
+
+用法示例：
+    python bench.py --scenario small --out small.json
+    python bench.py --scenario mixed --latency-ms 50 --fail 503=0.02 --fail 429=0.01 --set upload_workers=4
+    python bench.py --scenario small --set enable_batch_commit=true --baseline small.json
+"""
+import os
+import sys
+import re
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+os.environ["HF_HUB_DISABLE_XET"] = "1" # 模拟服务器只实现 LFS 协议，必须在导入 huggingface_hub 之前设置
+os.environ.setdefault("HF_HUB_DISABLE_TELEMETRY", "1")
+os.environ.setdefault("HF_HUB_DISABLE_PROGRESS_BARS", "1")
+
+import app
+
+# 🌟 模拟 Hub：whoami / preupload / LFS (basic + multipart) / commit / paths-info / tree
+class MockHub:
+    def __init__(self, latency=0.0, failures=None, multipart_mb=64, chunk_mb=16):
+        self.latency = latency
+        self.failures = failures or {}   # HTTP 状态码 -> 注入概率
+        self.multipart_bytes = multipart_mb * 1024 * 1024
+        self.chunk_bytes = chunk_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        self.objects = {}  # LFS oid -> 大小
+        self.parts = {}    # (oid, 分片号) -> 分片大小
+        self.files = {}    # 仓库路径 -> (大小, sha256)
+        self.manifests = {} # 打包分片的 manifest 路径 -> 内容
+        self.requests = {}
+        self.injected = {}
+        self.bytes_received = 0
+        self.commits = 0
+        self.commit_times = [] # (时间, 本次提交的文件数)
+        self.server = None
+
+    def start(self):
+        hub = self
+
+        class Handler(HubHandler):
+            pass
+        Handler.hub = hub
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def count(self, name):
+        with self.lock: self.requests[name] = self.requests.get(name, 0) + 1
+
+    def inject(self, name):
+        """按概率返回要注入的错误状态码"""
+        for status, rate in self.failures.items():
+            if random.random() < rate:
+                with self.lock: self.injected[f"{name}:{status}"] = self.injected.get(f"{name}:{status}", 0) + 1
+                return status
+        return None
+
+    def committed_files(self):
+        """已提交的源文件数：打包上传的按 manifest 里列出的文件算，分片和 manifest 本身不算"""
+        with self.lock:
+            packed = {p[:-len(".manifest.json")]: len(m.get("files", [])) for p, m in self.manifests.items()}
+            return sum(packed.values()) + sum(1 for p in self.files if p not in packed and p not in self.manifests)
+
+class HubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # 保持长连接，和真实 Hub 一样复用连接
+    disable_nagle_algorithm = True # 响应头和响应体分两次写出，不关 Nagle 每个请求会多等 40ms 的延迟确认
+    hub = None
+    ROUTES = [
+        ("GET", re.compile(r"^/api/whoami-v2$"), "whoami"),
+        ("POST", re.compile(r"^/api/(?P<type>\w+)s/(?P<repo>[^/]+/[^/]+)/preupload/(?P<rev>[^/]+)$"), "preupload"),
+        ("POST", re.compile(r"^/api/(?P<type>\w+)s/(?P<repo>[^/]+/[^/]+)/commit/(?P<rev>[^/]+)$"), "commit"),
+        ("POST", re.compile(r"^/api/(?P<type>\w+)s/(?P<repo>[^/]+/[^/]+)/paths-info/(?P<rev>[^/]+)$"), "paths_info"),
+        ("GET", re.compile(r"^/api/(?P<type>\w+)s/(?P<repo>[^/]+/[^/]+)/tree/(?P<rev>[^/]+)(?P<path>/.*)?$"), "tree"),
+        ("POST", re.compile(r"^/(?:\w+s/)?(?P<repo>[^/]+/[^/]+)\.git/info/lfs/objects/batch$"), "lfs_batch"),
+        ("PUT", re.compile(r"^/lfs/upload/(?P<oid>[0-9a-f]{64})$"), "lfs_put"),
+        ("PUT", re.compile(r"^/lfs/part/(?P<oid>[0-9a-f]{64})/(?P<part>\d+)$"), "lfs_part"),
+        ("POST", re.compile(r"^/lfs/complete/(?P<oid>[0-9a-f]{64})$"), "lfs_complete"),
+        ("POST", re.compile(r"^/lfs/verify$"), "lfs_verify"),
+    ]
+    INJECTABLE = {"preupload", "commit", "lfs_batch", "lfs_put", "lfs_part"}
+
+    def log_message(self, *args): pass
+
+    def _dispatch(self, method):
+        url = urlsplit(self.path)
+        for route_method, pattern, name in self.ROUTES:
+            match = pattern.match(url.path) if route_method == method else None
+            if not match: continue
+            self.hub.count(name)
+            if self.hub.latency: time.sleep(self.hub.latency)
+            if name in self.INJECTABLE:
+                status = self.hub.inject(name)
+                if status:
+                    self._drain_body()
+                    headers = {"Retry-After": "1"} if status == 429 else {}
+                    return self._json(status, {"error": f"injected {status}"}, headers)
+            return getattr(self, name)(match, parse_qs(url.query))
+        self._drain_body()
+        self._json(404, {"error": f"not found: {method} {url.path}"})
+
+    def do_GET(self): self._dispatch("GET")
+    def do_POST(self): self._dispatch("POST")
+    def do_PUT(self): self._dispatch("PUT")
+
+    # ---------- 请求体 / 响应 ----------
+    def _iter_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return
+                yield self.rfile.read(size)
+                self.rfile.readline()
+        remaining = int(self.headers.get('Content-Length') or 0)
+        while remaining > 0:
+            data = self.rfile.read(min(remaining, 1024 * 1024))
+            if not data: return
+            remaining -= len(data)
+            yield data
+
+    def _body(self):
+        return b"".join(self._iter_body())
+
+    def _drain_body(self):
+        for _ in self._iter_body(): pass
+
+    def _json(self, status, obj, headers=None):
+        data = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _base(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    @staticmethod
+    def _file_info(path, size, sha256):
+        pointer = f"version https://git-lfs.github.com/spec/v1\noid sha256:{sha256}\nsize {size}\n".encode()
+        blob_id = hashlib.sha1(b"blob %d\0" % len(pointer) + pointer).hexdigest()
+        return {"type": "file", "path": path, "size": size, "oid": blob_id,
+                "lfs": {"oid": sha256, "size": size, "pointerSize": len(pointer)}}
+
+    # ---------- Hub API ----------
+    def whoami(self, match, query):
+        self._json(200, {"type": "user", "name": "bench", "auth": {"accessToken": {"role": "write"}}})
+
+    def preupload(self, match, query):
+        payload = json.loads(self._body() or b'{}')
+        # 和真实 Hub 一样，小的 JSON 文本 (如打包 manifest) 走普通提交，内容直接放在 commit 里
+        self._json(200, {"files": [{"path": f["path"], "shouldIgnore": False, "oid": None,
+                                    "uploadMode": "regular" if f["path"].endswith(".json") and f.get("size", 0) < 10 * 1024 * 1024 else "lfs"}
+                                   for f in payload.get("files", [])]})
+
+    def lfs_batch(self, match, query):
+        payload = json.loads(self._body() or b'{}')
+        base, hub = self._base(), self.hub
+        objects = []
+        for obj in payload.get("objects", []):
+            oid, size = obj["oid"], obj["size"]
+            with hub.lock: exists = oid in hub.objects
+            if exists:
+                objects.append({"oid": oid, "size": size})
+                continue
+            verify = {"href": f"{base}/lfs/verify"}
+            if size >= hub.multipart_bytes and "multipart" in payload.get("transfers", []):
+                parts = -(-size // hub.chunk_bytes)
+                header = {"chunk_size": str(hub.chunk_bytes), **{str(n): f"{base}/lfs/part/{oid}/{n}" for n in range(1, parts + 1)}}
+                upload = {"href": f"{base}/lfs/complete/{oid}", "header": header}
+            else:
+                upload = {"href": f"{base}/lfs/upload/{oid}"}
+            objects.append({"oid": oid, "size": size, "actions": {"upload": upload, "verify": verify}})
+        self._json(200, {"transfer": "basic", "objects": objects})
+
+    def lfs_put(self, match, query):
+        oid, digest, size = match.group("oid"), hashlib.sha256(), 0
+        for data in self._iter_body():
+            digest.update(data)
+            size += len(data)
+        with self.hub.lock: self.hub.bytes_received += size
+        if digest.hexdigest() != oid: return self._json(400, {"error": "sha256 mismatch"})
+        with self.hub.lock: self.hub.objects[oid] = size
+        self._json(200, {})
+
+    def lfs_part(self, match, query):
+        oid, part = match.group("oid"), int(match.group("part"))
+        data = self._body()
+        with self.hub.lock:
+            self.hub.bytes_received += len(data)
+            self.hub.parts[(oid, part)] = len(data)
+        etag = hashlib.md5(data).hexdigest()
+        self.send_response(200)
+        self.send_header('ETag', f'"{etag}"')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def lfs_complete(self, match, query):
+        oid = match.group("oid")
+        payload = json.loads(self._body() or b'{}')
+        with self.hub.lock:
+            numbers = [p["partNumber"] for p in payload.get("parts", [])]
+            missing = [n for n in numbers if (oid, n) not in self.hub.parts]
+            if missing: return self._json(400, {"error": f"missing parts {missing}"})
+            self.hub.objects[oid] = sum(self.hub.parts.pop((oid, n)) for n in numbers) # 分片不在内存里拼接校验哈希
+        self._json(200, {})
+
+    def lfs_verify(self, match, query):
+        payload = json.loads(self._body() or b'{}')
+        with self.hub.lock: ok = payload.get("oid") in self.hub.objects
+        self._json(200 if ok else 404, {} if ok else {"error": "object not found"})
+
+    def commit(self, match, query):
+        lines = [json.loads(line) for line in self._body().splitlines() if line.strip()]
+        changes = {}
+        with self.hub.lock:
+            for item in lines:
+                key, value = item.get("key"), item.get("value") or {}
+                if key == "lfsFile":
+                    if value["oid"] not in self.hub.objects:
+                        return self._json(422, {"error": f"LFS object {value['oid']} not uploaded"})
+                    changes[value["path"]] = (self.hub.objects[value["oid"]], value["oid"])
+                elif key == "file":
+                    content = base64.b64decode(value.get("content", ""))
+                    changes[value["path"]] = (len(content), hashlib.sha256(content).hexdigest())
+                    if value["path"].endswith(".manifest.json"):
+                        try: self.hub.manifests[value["path"]] = json.loads(content)
+                        except ValueError: pass
+            self.hub.files.update(changes)
+            self.hub.commits += 1
+            self.hub.commit_times.append((time.time(), len(changes)))
+            number = self.hub.commits
+        oid = hashlib.sha1(str(number).encode()).hexdigest()
+        self._json(200, {"commitUrl": f"{self._base()}/{match.group('type')}s/{match.group('repo')}/commit/{oid}",
+                         "commitOid": oid, "pullRequestUrl": None})
+
+    def paths_info(self, match, query):
+        form = parse_qs(self._body().decode())
+        with self.hub.lock:
+            found = [(p, self.hub.files[p]) for p in form.get("paths", []) if p in self.hub.files]
+        self._json(200, [self._file_info(p, size, sha) for p, (size, sha) in found])
+
+    def tree(self, match, query):
+        prefix = unquote((match.group("path") or "").lstrip("/"))
+        with self.hub.lock:
+            found = [(p, v) for p, v in self.hub.files.items() if not prefix or p == prefix or p.startswith(prefix + "/")]
+        self._json(200, [self._file_info(p, size, sha) for p, (size, sha) in found])
+
+# 🌟 合成目录树
+def write_file(path, size, seed):
+    """写入指定大小的文件。每个文件开头带唯一种子，保证内容 (哈希) 各不相同"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    block = hashlib.sha256(seed.encode()).digest() * (1024 * 1024 // 32)
+    with open(path, 'wb') as f:
+        head = seed.encode()[:size]
+        f.write(head)
+        remaining = size - len(head)
+        while remaining > 0:
+            n = min(remaining, len(block))
+            f.write(block[:n])
+            remaining -= n
+
+def generate_tree(root, scenario, scale=1.0):
+    """返回 (文件数, 总字节数)"""
+    files = []
+    def add(rel, size): files.append((rel, max(1, int(size))))
+
+    if scenario in ("small", "mixed"): # 大量小文件
+        count = max(1, int(2000 * scale))
+        for i in range(count):
+            add(f"small/dir{i % 20:02d}/file{i:05d}.bin", random.randint(1, 64) * 1024)
+    if scenario in ("large", "mixed"): # 少量大文件
+        for i in range(max(1, int(4 * scale))):
+            add(f"large/movie{i}.mkv", 256 * 1024 * 1024 * min(scale, 1.0))
+    if scenario in ("deep", "mixed"): # 深层嵌套
+        depth, branching = 6, 3
+        def walk(prefix, level):
+            for j in range(max(1, int(3 * scale))): add(f"{prefix}/f{j}.dat", 8 * 1024)
+            if level < depth:
+                for b in range(branching if level > 1 else 2): walk(f"{prefix}/d{b}", level + 1)
+        walk("deep", 1)
+
+    for n, (rel, size) in enumerate(files):
+        write_file(os.path.join(root, rel), size, f"{scenario}-{n}-{rel}")
+    return len(files), sum(size for _, size in files)
+
+def parse_value(text):
+    lowered = text.lower()
+    if lowered in ("true", "false"): return lowered == "true"
+    try: return int(text)
+    except ValueError:
+        try: return float(text)
+        except ValueError: return text
+
+# 🌟 扫描开销：冷启动 (无索引) 和热启动 (目录未变化) 各扫一遍
+def bench_scan(config, store):
+    file_filter = app.create_file_filter(config)
+    scanner = app.PollingScanner(file_filter, store)
+    start = time.perf_counter()
+    found = len(scanner.candidates())
+    cold = time.perf_counter() - start
+    time.sleep(2.1) # 超过目录索引的“刚修改”保护期
+    scanner.candidates()
+    start = time.perf_counter()
+    scanner.candidates()
+    warm = time.perf_counter() - start
+    return {"files_found": found, "cold_seconds": round(cold, 4), "warm_seconds": round(warm, 4)}
+
+def histogram_stats(name, **labels):
+    with app.METRICS.lock:
+        stats = [v for (metric, key), v in app.METRICS.values.items()
+                 if metric == name and all(dict(key).get(k) == v2 for k, v2 in labels.items())]
+    total = sum(v[1] for v in stats)
+    count = sum(v[2] for v in stats)
+    return {"count": count, "total_seconds": round(total, 4), "avg_seconds": round(total / count, 4) if count else None}
+
+def counter_total(name):
+    with app.METRICS.lock:
+        return sum(v for (metric, _), v in app.METRICS.values.items() if metric == name)
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def run(args):
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix="hf-bench-")
+    app.DATA_DIR = os.path.join(workdir, "data")
+    config_dir = os.path.join(workdir, "config")
+    os.makedirs(app.DATA_DIR)
+    os.makedirs(config_dir)
+    app.CONFIG_FILE = os.path.join(config_dir, "settings.json")
+    app.FAILURE_RECORD_FILE = os.path.join(config_dir, "failures.json")
+    app.STATE_DB_FILE = os.path.join(config_dir, "state.db")
+
+    print(f"🧪 生成目录树: {args.scenario} (scale={args.scale}) -> {app.DATA_DIR}")
+    file_count, total_bytes = generate_tree(app.DATA_DIR, args.scenario, args.scale)
+    print(f"   {file_count} 个文件, {total_bytes / (1024*1024):.1f} MB")
+
+    failures = {int(k): float(v) for k, v in (item.split("=", 1) for item in args.fail)}
+    hub = MockHub(latency=args.latency_ms / 1000.0, failures=failures, multipart_mb=args.multipart_mb)
+    endpoint = hub.start()
+
+    config = dict(app.DEFAULT_CONFIG, hf_endpoint=endpoint, hf_token="hf_bench", repo_id="bench/repo",
+                  repo_type="dataset", remote_folder="", stability_duration=0, delete_after_upload=False,
+                  enable_idle_email=False, email_user="", email_pass="", max_commits_per_min=6000, watch_mode="poll")
+    for item in args.set:
+        key, value = item.split("=", 1)
+        config[key] = parse_value(value)
+
+    scan_store = app.StateStore(os.path.join(config_dir, "scan-bench.db"))
+    scan = bench_scan(config, scan_store)
+    scan_store.close()
+
+    app.stop_event.clear()
+    app.is_running = True
+    started = time.time()
+    daemon = threading.Thread(target=app.uploader_daemon, args=(config,), daemon=True)
+    daemon.start()
+    deadline = started + args.timeout
+    while time.time() < deadline and daemon.is_alive():
+        if hub.committed_files() >= file_count: break
+        time.sleep(0.05)
+    finished = time.time()
+    app.stop_event.set()
+    daemon.join(timeout=60)
+    hub.stop()
+
+    elapsed = finished - started
+    uploaded = hub.committed_files()
+    first_commit = hub.commit_times[0][0] - started if hub.commit_times else None
+    result = {
+        "version": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+        "python": sys.version.split()[0],
+        "scenario": args.scenario,
+        "params": {"scale": args.scale, "latency_ms": args.latency_ms, "fail": failures, "seed": args.seed,
+                   "overrides": {item.split("=", 1)[0]: parse_value(item.split("=", 1)[1]) for item in args.set}},
+        "files": file_count,
+        "bytes": total_bytes,
+        "uploaded_files": uploaded,
+        "completed": uploaded >= file_count,
+        "elapsed_seconds": round(elapsed, 3),
+        "files_per_sec": round(uploaded / elapsed, 3) if elapsed > 0 else None,
+        "mb_per_sec": round(hub.bytes_received / (1024*1024) / elapsed, 3) if elapsed > 0 else None,
+        "time_to_first_upload_seconds": round(first_commit, 3) if first_commit is not None else None,
+        "scan": scan,
+        "daemon_scan": histogram_stats("hf_uploader_scan_duration_seconds"),
+        "commits": hub.commits,
+        "retries": counter_total("hf_uploader_retries_total"),
+        "hub_requests": dict(sorted(hub.requests.items())),
+        "injected_errors": dict(sorted(hub.injected.items())),
+        "bytes_received": hub.bytes_received,
+    }
+    return result
+
+def compare(result, baseline):
+    print(f"📊 对比基线 {baseline.get('version')} ({baseline.get('timestamp')}):")
+    for key, better in (("files_per_sec", "higher"), ("mb_per_sec", "higher"), ("time_to_first_upload_seconds", "lower"),
+                        ("elapsed_seconds", "lower"), ("commits", "lower"), ("retries", "lower")):
+        old, new = baseline.get(key), result.get(key)
+        if not old or new is None: continue
+        change = (new - old) / old * 100
+        good = change >= 0 if better == "higher" else change <= 0
+        print(f"   {'✅' if good else '⚠️'} {key}: {old} -> {new} ({change:+.1f}%)")
+    for key in ("cold_seconds", "warm_seconds"):
+        old, new = baseline.get("scan", {}).get(key), result["scan"].get(key)
+        if old and new is not None:
+            print(f"   {'✅' if new <= old else '⚠️'} scan.{key}: {old} -> {new} ({(new - old) / old * 100:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description="HF Uploader 离线性能基准 (本地模拟 Hub)")
+    parser.add_argument("--scenario", choices=("small", "large", "deep", "mixed"), default="small",
+                        help="small: 大量小文件; large: 少量大文件; deep: 深层嵌套; mixed: 三者混合")
+    parser.add_argument("--scale", type=float, default=1.0, help="按比例放大/缩小文件数量 (large 场景 <1 时同时缩小文件大小)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="模拟 Hub 每个请求的额外延迟 (毫秒)")
+    parser.add_argument("--fail", action="append", default=[], metavar="STATUS=RATE",
+                        help="按概率注入错误，如 503=0.02 或 429=0.01 (429 带 Retry-After: 1)，可重复")
+    parser.add_argument("--multipart-mb", type=int, default=64, help="超过该大小的 LFS 对象使用 multipart 分片")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="覆盖 app 配置，如 upload_workers=4 或 enable_batch_commit=true，可重复")
+    parser.add_argument("--timeout", type=float, default=1800, help="最长运行秒数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="结果 JSON 输出路径 (默认打印到标准输出)")
+    parser.add_argument("--baseline", help="与之前的结果 JSON 对比")
+    args = parser.parse_args()
+
+    result = run(args)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f: f.write(text + "\n")
+        print(f"💾 结果已写入 {args.out}")
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f: compare(result, json.load(f))
+    sys.exit(0 if result["completed"] else 1)
+
+if __name__ == '__main__':
+    main()
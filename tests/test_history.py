@@ -0,0 +1,54 @@
+import app
+
+def make_store(tmp_path, rows):
+    store = app.StateStore(str(tmp_path / "state.db"))
+    for rel, updated_at, status in rows:
+        store._write(rel, {'status': status, 'size': 1, 'mtime': 1.0, 'attempts': 1, 'remote_path': rel,
+                           'failed_since': None, 'updated_at': updated_at})
+    return store
+
+def page_all(store, limit, status=None, query='', between=None):
+    seen, before, page = [], None, 0
+    while True:
+        items, has_more = store.history(status, query, before, limit)
+        seen += [item['path'] for item in items]
+        page += 1
+        if between: between(page)
+        if not has_more: return seen
+        before = (items[-1]['updated_at'], items[-1]['path'])
+
+def test_pages_cover_tied_timestamps_in_order(tmp_path):
+    # 每 3 条共用一个时间戳，而且写入顺序和路径顺序相反
+    rows = [(f"f{i:02d}", 1000 + i // 3, 'uploaded') for i in reversed(range(30))]
+    store = make_store(tmp_path, rows)
+    expected = [rel for rel, _, _ in sorted(rows, key=lambda r: (r[1], r[0]), reverse=True)]
+    for limit in (1, 2, 3, 4, 7, 30, 50):
+        assert page_all(store, limit) == expected
+    store.close()
+
+def test_rows_moving_to_the_front_are_not_repeated(tmp_path):
+    store = make_store(tmp_path, [(f"f{i:02d}", 1000 + i, 'uploaded') for i in range(30)])
+    moved = ['f29', 'f03', 'f15']
+    def between(page):
+        if page == 2:
+            for rel in moved: store._update(rel, status='failed')
+    seen = page_all(store, 4, between=between)
+    assert len(seen) == len(set(seen))
+    # 没动过的记录一条都不能漏；翻过去之后才更新的记录挪到了最前面，刷新后再看到
+    assert set(seen) >= {f"f{i:02d}" for i in range(30)} - set(moved)
+    store.close()
+
+def test_filters_with_cursor(tmp_path):
+    rows = [(f"{'cat' if i % 2 else 'dog'}/{i:02d}", 1000 + i // 4, 'failed' if i % 3 == 0 else 'uploaded') for i in range(40)]
+    store = make_store(tmp_path, rows)
+    expected = [rel for rel, _, status in sorted(rows, key=lambda r: (r[1], r[0]), reverse=True)
+                if status == 'failed' and 'cat' in rel]
+    assert page_all(store, 2, status='failed', query='CAT') == expected
+    store.close()
+
+def test_order_survives_reload(tmp_path):
+    rows = [(f"f{i:02d}", 1000 + i // 5, 'uploaded') for i in reversed(range(20))]
+    make_store(tmp_path, rows).close()
+    store = app.StateStore(str(tmp_path / "state.db"))
+    assert page_all(store, 3) == [rel for rel, _, _ in sorted(rows, key=lambda r: (r[1], r[0]), reverse=True)]
+    store.close()
@@ -0,0 +1,75 @@
+import io, os, tarfile, zipfile
+
+import pytest
+
+import app
+
+SIZES = [0, 1, 511, 512, 513, 70000, 1024 * 1024 + 3]
+
+@pytest.fixture
+def members(tmp_path):
+    result = []
+    for i, size in enumerate(SIZES):
+        rel = f"dir/子目录/f{i}.bin" if i % 2 else f"dir/f{i}.bin"
+        path = tmp_path / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(os.urandom(size))
+        result.append((str(path), rel, size, 1700000000 + i))
+    return result
+
+def read_all(shard):
+    shard.seek(0)
+    data = shard.read()
+    assert len(data) == shard.size
+    return data
+
+def check_manifest(shard, data, members):
+    manifest = shard.manifest("pack-0001")
+    assert manifest["shard"] == "pack-0001" and manifest["format"] == shard.fmt
+    assert [f["path"] for f in manifest["files"]] == [m[1] for m in members]
+    for entry, (path, _, size, _) in zip(manifest["files"], members):
+        assert entry["size"] == size
+        assert data[entry["offset"]:entry["offset"] + size] == open(path, 'rb').read()
+
+def test_tar_layout(members):
+    shard = app.PackedShard('tar', members)
+    data = read_all(shard)
+    assert len(data) % 512 == 0
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        assert tar.getnames() == [m[1] for m in members]
+        for path, rel, size, mtime in members:
+            info = tar.getmember(rel)
+            assert (info.size, info.mtime) == (size, mtime)
+            assert tar.extractfile(info).read() == open(path, 'rb').read()
+    check_manifest(shard, data, members)
+
+def test_zip_layout(members):
+    shard = app.PackedShard('zip', members)
+    data = read_all(shard)
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None # 逐个核对 CRC
+        assert zf.namelist() == [m[1] for m in members]
+        for path, rel, size, _ in members:
+            assert zf.getinfo(rel).file_size == size
+            assert zf.read(rel) == open(path, 'rb').read()
+    check_manifest(shard, data, members)
+
+def test_zip_random_access_fills_crc(members):
+    # 没有顺序读过就直接读末尾的中央目录，CRC 要现场补算，结果和顺序读取的一致
+    expected = read_all(app.PackedShard('zip', members))
+    shard = app.PackedShard('zip', members)
+    shard.seek(-2000, io.SEEK_END)
+    tail = shard.read()
+    assert tail == expected[-2000:]
+    assert read_all(shard) == expected
+
+def test_small_reads_match_full_read(members):
+    for fmt in app.PackedShard.FORMATS:
+        expected = read_all(app.PackedShard(fmt, members))
+        shard = app.PackedShard(fmt, members)
+        chunks = []
+        while True:
+            chunk = shard.read(4093)
+            if not chunk: break
+            chunks.append(chunk)
+        assert b"".join(chunks) == expected